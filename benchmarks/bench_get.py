@@ -0,0 +1,73 @@
+"""
+Download throughput of `Metatree.get(..., outfile=...)` by block size and
+number of workers.
+
+    python benchmarks/bench_get.py [--size-mb 64] [--latency 0.02] [--bandwidth-mb 100]
+
+The tree lives on fsspec's memory filesystem. Every ranged read pays a fixed
+request latency and is throttled to a per-connection bandwidth, standing in
+for a remote object store.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+from time import perf_counter, sleep
+
+from fsspec.implementations.memory import MemoryFileSystem
+
+from metatree import Metatree
+
+
+class ThrottledMemoryFileSystem(MemoryFileSystem):
+    latency = 0.0
+    bandwidth = None
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        data = super().cat_file(path, start=start, end=end, **kwargs)
+        sleep(self.latency + (len(data) / self.bandwidth if self.bandwidth else 0))
+        return data
+
+    def get_file(self, rpath, lpath, **kwargs):
+        with open(lpath, "wb") as file:
+            file.write(self.cat_file(rpath))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--bandwidth-mb", type=float, default=100)
+    args = parser.parse_args()
+    fs = ThrottledMemoryFileSystem(skip_instance_cache=True)
+    basepath = tempfile.mkdtemp()
+    try:
+        artifact = f"{basepath}/model.bin"
+        with open(artifact, "wb") as file:
+            file.write(os.urandom(args.size_mb << 20))
+        metatree = Metatree(
+            f"memory://{os.path.basename(basepath)}", ("model", "version"), fs=fs
+        )
+        metatree.put("model_a/v1", artifact)
+        fs.latency = args.latency
+        fs.bandwidth = args.bandwidth_mb * (1 << 20)
+        print(f"{'block MB':>8} {'workers':>7} {'MB/s':>8}")
+        for block_mb, workers in ((64, 1), (8, 1), (8, 4), (8, 8), (4, 16)):
+            outfile = f"{basepath}/out-{block_mb}-{workers}.bin"
+            started = perf_counter()
+            metatree.get(
+                "model_a/v1/model.bin",
+                outfile=outfile,
+                block_size=block_mb << 20,
+                max_workers=workers,
+            )
+            throughput = args.size_mb / (perf_counter() - started)
+            print(f"{block_mb:>8} {workers:>7} {throughput:>8.1f}")
+    finally:
+        shutil.rmtree(basepath)
+
+
+if __name__ == "__main__":
+    main()
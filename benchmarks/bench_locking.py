@@ -0,0 +1,56 @@
+"""
+Metadata write throughput against the number of distinct subtrees written.
+
+    python benchmarks/bench_locking.py [--writers 8] [--updates 25]
+
+Every writer updates the metadata of one `model_<n>/v1` node. With a single
+subtree all writers contend for the same node lock; with one subtree per
+writer they only share intent locks on the root.
+"""
+
+import argparse
+import shutil
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from metatree import Metatree
+
+
+def run(basepath, writers, subtrees, updates):
+    metatree = Metatree(f"{basepath}/metatree-{subtrees}", ("model", "version"))
+    for n in range(subtrees):
+        metatree.set_location_to_root()
+        metatree._find(f"model_{n}/v1", create_location_if_not_exists=True)
+    nodes = [metatree.find(f"model_{n % subtrees}/v1") for n in range(writers)]
+
+    def write(node):
+        for i in range(updates):
+            node.update(step=i)
+
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        list(executor.map(write, nodes))
+    return writers * updates / (perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--updates", type=int, default=25)
+    args = parser.parse_args()
+    basepath = tempfile.mkdtemp()
+    try:
+        print(f"{'subtrees':>8} {'writes/s':>10}")
+        subtrees = 1
+        while subtrees <= args.writers:
+            throughput = run(basepath, args.writers, subtrees, args.updates)
+            print(f"{subtrees:>8} {throughput:>10.1f}")
+            subtrees *= 2
+    finally:
+        shutil.rmtree(basepath)
+
+
+if __name__ == "__main__":
+    main()
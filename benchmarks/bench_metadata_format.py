@@ -0,0 +1,35 @@
+"""
+Parse time and file size of node metadata in the JSON and packed encodings.
+
+    python benchmarks/bench_metadata_format.py
+"""
+
+from timeit import Timer
+
+from metatree.io_handler import IOHandler, PackedIOHandler
+
+
+def document(children):
+    return dict(
+        children=[f"v{i}" for i in range(children)],
+        active="v1",
+        stage="prod",
+        files={"trained.pkl": dict(size=4, checksum="sha256:00", mtime=0.0)},
+    )
+
+
+def main():
+    print(f"{'children':>8} {'handler':>8} {'bytes':>9} {'parse us':>10}")
+    for children in (10, 1_000, 100_000):
+        metadata = document(children)
+        for name, handler in (("json", IOHandler), ("packed", PackedIOHandler)):
+            data = handler.dumps(metadata)
+            assert handler.loads(data) == handler.loads(handler.dumps(metadata))
+            timer = Timer(lambda: handler.loads(data))
+            number, _ = timer.autorange()
+            elapsed = min(timer.repeat(repeat=3, number=number)) / number
+            print(f"{children:>8} {name:>8} {len(data):>9} {elapsed * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
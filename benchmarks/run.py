@@ -0,0 +1,266 @@
+"""
+Latency, throughput and remote call counts of the hot Metatree operations.
+
+    PYTHONPATH=. python benchmarks/run.py [--backend memory local http] [--latency 0.005]
+
+- find: latency by tree depth and fan-out
+- put / update: throughput with locking on and off
+- get: throughput by file size
+
+Each operation starts from a root node handle, since `find` moves the handle
+it is called on. Every backend counts the filesystem calls made per operation. The memory and
+local backends add `--latency` to each call. The http backend serves a tree
+built on local disk through `tests/simple_http_server.py` with the same
+latency per request; it is read-only, so it only runs find and get.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import uuid
+
+from functools import partial, wraps
+from http.server import ThreadingHTTPServer
+from threading import Thread, local
+from time import perf_counter, sleep
+
+from fsspec.implementations.local import LocalFileSystem
+from fsspec.implementations.memory import MemoryFileSystem
+
+from metatree import Metatree
+from metatree.io_handler import IOHandler
+
+_methods = (
+    "cat",
+    "cat_file",
+    "exists",
+    "find",
+    "get_file",
+    "info",
+    "isdir",
+    "ls",
+    "makedirs",
+    "mkdir",
+    "mv",
+    "open",
+    "pipe",
+    "pipe_file",
+    "put",
+    "put_file",
+    "rm",
+    "rm_file",
+    "size",
+    "touch",
+)
+
+
+class CallCounter:
+    """Counts outermost filesystem calls and adds a fixed latency to each."""
+
+    def __init__(self, fs, latency=0.0):
+        self.calls = 0
+        self.latency = latency
+        self._depth = local()
+        for name in _methods:
+            if hasattr(fs, name):
+                setattr(fs, name, self._wrap(getattr(fs, name)))
+
+    def _wrap(self, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            depth = getattr(self._depth, "value", 0)
+            if depth == 0:
+                self.calls += 1
+                if self.latency:
+                    sleep(self.latency)
+            self._depth.value = depth + 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._depth.value = depth
+
+        return wrapper
+
+
+def build_path(metatree, depth, fanout):
+    """Give every level `fanout` children and return the path of the deepest."""
+    path = []
+    for level in range(depth):
+        for i in range(fanout):
+            metatree._node({})._find(
+                "/".join([*path, f"n{i:04d}"]), create_location_if_not_exists=True
+            )
+        path.append(f"n{fanout - 1:04d}")
+    return "/".join(path)
+
+
+def measure(counter, func, repeat):
+    calls, started = counter.calls, perf_counter()
+    for i in range(repeat):
+        func(i)
+    elapsed = perf_counter() - started
+    return elapsed / repeat, (counter.calls - calls) / repeat
+
+
+def report(backend, operation, params, seconds, calls, size=None):
+    rate = (
+        f"{size / seconds / (1 << 20):9.1f} MB/s"
+        if size
+        else f"{1 / seconds:9.1f} op/s"
+    )
+    print(
+        f"{backend:<7} {operation:<7} {params:<22} "
+        f"{seconds * 1000:9.2f} ms {rate} {calls:7.1f} calls"
+    )
+
+
+def writable_tree(backend, basepath, keys, latency, **kwargs):
+    if backend == "memory":
+        fs = MemoryFileSystem(skip_instance_cache=True)
+        root = f"memory://bench-{uuid.uuid4().hex[:8]}"
+    else:
+        fs = LocalFileSystem(skip_instance_cache=True)
+        root = f"{basepath}/{uuid.uuid4().hex[:8]}"
+    metatree = Metatree(root, keys, fs=fs, **kwargs)
+    return metatree, CallCounter(fs, latency)
+
+
+def serve(directory, latency):
+    from tests.simple_http_server import JSONDirectoryHandler
+
+    class Handler(JSONDirectoryHandler):
+        def handle_one_request(self):
+            sleep(latency)
+            super().handle_one_request()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(Handler, directory=directory)
+    )
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def http_tree(basepath, keys, latency):
+    from fsspec.implementations.http import HTTPFileSystem
+
+    server = serve(basepath, latency)
+    fs = HTTPFileSystem(skip_instance_cache=True)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    return server, url, fs
+
+
+def bench_find(backend, basepath, args):
+    for depth in (1, 2, 4):
+        for fanout in (10, 100):
+            keys = tuple(f"k{i}" for i in range(depth))
+            if backend == "http":
+                local_tree = Metatree(f"{basepath}/find-{depth}-{fanout}", keys)
+                path = build_path(local_tree, depth, fanout)
+                server, url, fs = http_tree(basepath, keys, args.latency)
+                metatree = Metatree(
+                    f"{url}/find-{depth}-{fanout}", io_handler=IOHandler, fs=fs
+                )
+                counter = CallCounter(fs)
+            else:
+                metatree, counter = writable_tree(
+                    backend, basepath, keys, 0.0, locking_enabled=False
+                )
+                path = build_path(metatree, depth, fanout)
+                counter.latency = args.latency
+            seconds, calls = measure(
+                counter, lambda i: metatree._node({}).find(path), args.repeat
+            )
+            report(backend, "find", f"depth={depth} fanout={fanout}", seconds, calls)
+            if backend == "http":
+                server.shutdown()
+
+
+def bench_put_update(backend, basepath, args):
+    artifact = f"{basepath}/small.bin"
+    with open(artifact, "wb") as file:
+        file.write(os.urandom(1024))
+    for locking_enabled in (True, False):
+        metatree, counter = writable_tree(
+            backend,
+            basepath,
+            ("model", "version"),
+            args.latency,
+            locking_enabled=locking_enabled,
+        )
+        params = f"locking={'on' if locking_enabled else 'off'}"
+        seconds, calls = measure(
+            counter,
+            lambda i: metatree._node({}).put(f"model_a/v{i}", artifact),
+            args.repeat,
+        )
+        report(backend, "put", params, seconds, calls)
+        node = metatree.find("model_a/v0")
+        seconds, calls = measure(
+            counter, lambda i: node.update(stage=f"s{i}"), args.repeat
+        )
+        report(backend, "update", params, seconds, calls)
+
+
+def bench_get(backend, basepath, args):
+    for size in (1 << 10, 1 << 20, 16 << 20):
+        artifact = f"{basepath}/artifact-{size}.bin"
+        with open(artifact, "wb") as file:
+            file.write(os.urandom(size))
+        if backend == "http":
+            # The JSON directory listing is not understood by fsspec's HTTP
+            # filesystem, so files are resolved through the manifest.
+            local_tree = Metatree(
+                f"{basepath}/get-{size}", ("model", "version"), manifest_enabled=True
+            )
+            local_tree.put("model_a/v1", artifact)
+            server, url, fs = http_tree(basepath, None, args.latency)
+            metatree = Metatree(f"{url}/get-{size}", io_handler=IOHandler, fs=fs)
+            counter = CallCounter(fs)
+        else:
+            metatree, counter = writable_tree(
+                backend, basepath, ("model", "version"), 0.0
+            )
+            metatree.put("model_a/v1", artifact)
+            counter.latency = args.latency
+
+        def get(i):
+            outfile = f"{basepath}/out-{uuid.uuid4().hex[:8]}.bin"
+            metatree._node({}).get(
+                f"model_a/v1/{os.path.basename(artifact)}", outfile=outfile
+            )
+            os.unlink(outfile)
+
+        seconds, calls = measure(counter, get, max(1, args.repeat // 10))
+        report(backend, "get", f"size={size >> 10}KiB", seconds, calls, size=size)
+        if backend == "http":
+            server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--backend",
+        nargs="+",
+        choices=("memory", "local", "http"),
+        default=("memory", "local", "http"),
+    )
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    for backend in args.backend:
+        basepath = tempfile.mkdtemp()
+        try:
+            bench_find(backend, basepath, args)
+            if not backend == "http":
+                bench_put_update(backend, basepath, args)
+            bench_get(backend, basepath, args)
+        finally:
+            shutil.rmtree(basepath)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,3 @@
-from .metatree import Metatree
\ No newline at end of file
+from .metatree import Metatree
+from .aio import AsyncMetatree
+from .errors import VersionConflictError
@@ -0,0 +1,198 @@
+import asyncio
+
+from functools import partial
+from os.path import basename
+from pathlib import Path
+
+from .changes import matches
+from .children import contains, normalize
+from .metatree import Metatree
+from .util import public_metadata
+
+
+class AsyncMetatree:
+    """
+    asyncio front end of a `Metatree`.
+
+    Reads go through the coroutine API of fsspec async filesystems (s3fs,
+    HTTP, ...) and independent reads are issued together; other filesystems
+    are driven from the default executor. Writes reuse the synchronous
+    locking protocol in the executor.
+    """
+
+    def __init__(self, root, keys: tuple = None, **kwargs):
+        self._tree = (
+            root if isinstance(root, Metatree) else Metatree(root, keys, **kwargs)
+        )
+
+    @property
+    def root(self):
+        return self._tree.root
+
+    @property
+    def metatree(self):
+        return self._tree
+
+    async def _run(self, method, *args, **kwargs):
+        fs = self._tree._fs
+        if getattr(fs, "async_impl", False):
+            coroutine = getattr(fs, f"_{method}")(*args, **kwargs)
+            if fs.asynchronous:
+                return await coroutine
+            # Sync-mode async filesystems own an event loop in a background
+            # thread; run the coroutine there and await it from this loop.
+            return await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(coroutine, fs.loop)
+            )
+        return await self._in_executor(getattr(fs, method), *args, **kwargs)
+
+    async def _in_executor(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def _to_dict(self, location):
+        if self._tree._replica is not None:
+            return self._tree._to_dict(location)
+        io_handler = self._tree._io_handler
+        filepath = f"{location}/{io_handler._metadata_filename}"
+        metadata = normalize(io_handler.loads(await self._run("cat_file", filepath)))
+        self._tree._cache.put(filepath, metadata)
+        return metadata
+
+    async def _resolve(self, location):
+        if isinstance(location, str):
+            location = Metatree.parse_string_location(location, self._tree._keys)
+        resolved = {}
+        try:
+            metadata = await self._to_dict(self._tree._location_of(resolved))
+        except FileNotFoundError:
+            metadata = {}
+        for key in self._tree._keys:
+            child = location.get(key, None)
+            if child is None:
+                continue
+            child = Metatree.parse_child(child, metadata)
+            parent_location = self._tree._location_of(resolved)
+            resolved = {key: child, **resolved}
+            child_location = self._tree._location_of(resolved)
+            if not await self._has_child(parent_location, metadata, child):
+                if not await self._run("exists", child_location):
+                    raise Exception(f"Path ({child_location}) does not exist.")
+                raise Exception(f"Child ({child}) not found in metadata.")
+            try:
+                metadata = await self._to_dict(child_location)
+            except FileNotFoundError:
+                raise Exception(f"Path ({child_location}) does not exist.")
+        return resolved, metadata
+
+    async def _has_child(self, location, metadata, child):
+        if "children_pages" not in metadata:
+            return contains(metadata.get("children", []), child)
+        return await self._in_executor(self._tree._has_child, location, metadata, child)
+
+    async def _children_of(self, location, metadata):
+        if "children_pages" not in metadata:
+            return sorted(metadata.get("children", []))
+        return await self._in_executor(
+            lambda: list(self._tree._iter_children(location, metadata))
+        )
+
+    async def find(self, location):
+        self._tree.refresh()
+        resolved, _ = await self._resolve(location)
+        return self._tree._node(resolved)
+
+    async def find_many(self, locations):
+        self._tree.refresh()
+        resolved = await asyncio.gather(*(self._resolve(l) for l in locations))
+        return [self._tree._node(location) for location, _ in resolved]
+
+    async def list(self, location=None):
+        node = self._tree._node({}) if location is None else await self.find(location)
+        io_handler = self._tree._io_handler
+        names = [
+            basename(name.rstrip("/"))
+            for name in await self._run("ls", node.location, detail=False)
+        ]
+        return [
+            name
+            for name in names
+            if not name.startswith(
+                (io_handler._metadata_filename, *io_handler._reserved_prefixes)
+            )
+        ]
+
+    async def children(self, location=None):
+        if location is None:
+            self._tree.refresh()
+            resolved, metadata = {}, await self._to_dict(self._tree._location_of({}))
+        else:
+            resolved, metadata = await self._resolve(location)
+        children = await self._children_of(self._tree._location_of(resolved), metadata)
+        metadata = await asyncio.gather(
+            *(
+                self._to_dict(self._tree._location_of({**resolved, key: child}))
+                for key in self._tree._keys[len(resolved) : len(resolved) + 1]
+                for child in children
+            )
+        )
+        return dict(zip(children, map(public_metadata, metadata)))
+
+    async def get(self, location: str, outfile: str = None):
+        *parent, child = location.strip("/").split("/")
+        node = await self.find("/".join(parent)) if parent else self._tree._node({})
+        child = Metatree.parse_child(
+            (
+                {"metadata": child.strip(">").strip("<")}
+                if child.endswith(">") and child.startswith("<")
+                else {"value": child}
+            ),
+            node.metadata,
+        )
+        remote, _ = node._resolve_file(node.location, child)
+        if outfile is not None:
+            await self._run("get_file", remote, outfile)
+            return outfile
+        return await self._run("cat_file", remote)
+
+    async def put(self, location, filepath, recursive=False):
+        if self._tree._manifest_enabled:
+            return await self._in_executor(
+                self._tree._node({}).put, location, filepath, recursive=recursive
+            )
+        node, _ = await self._in_executor(
+            self._tree._node({})._find, location, create_location_if_not_exists=True
+        )
+        if not Path(filepath).exists():
+            raise Exception(f"File ({filepath}) does not exist.")
+        dst = f"{node.location}/{Path(filepath).name}"
+        if await self._run("exists", dst):
+            raise Exception(f"File ({filepath}) already exists.")
+        if recursive:
+            await self._run("put", str(filepath), dst, recursive=True)
+        else:
+            await self._run("put_file", str(filepath), dst)
+        exists = await self._run("exists", dst)
+        if exists:
+            await self._in_executor(
+                node._record_change, node.location, "put", files=[Path(filepath).name]
+            )
+        return exists
+
+    async def update(self, location, **kwargs):
+        node = await self.find(location)
+        await self._in_executor(node.update, **kwargs)
+        return node
+
+    async def watch(
+        self, prefix="", since: int = None, poll_interval=1.0, timeout=None
+    ):
+        change_log = self._tree._change_log
+        if change_log is None:
+            raise Exception("Change feed is not enabled.")
+        if since is None:
+            since = await self._in_executor(change_log.head)
+        await self._in_executor(change_log._check_since, since)
+        async for change in change_log.atail(self._run, since, poll_interval, timeout):
+            if matches(change, prefix):
+                yield change
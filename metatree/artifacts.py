@@ -0,0 +1,123 @@
+import hashlib
+import os
+import sqlite3
+import uuid
+
+from contextlib import closing
+from pathlib import Path
+from time import time
+
+
+class ArtifactCache:
+    """
+    Size-bounded on-disk cache of downloaded files.
+
+    Files are keyed by node location, file name and a version (checksum,
+    ETag or mtime), so a changed remote file never hits a stale copy. An
+    sqlite index in the cache directory tracks sizes and access times for
+    LRU eviction. Files are downloaded to a temporary name and published
+    with `os.replace`, which makes the cache safe to share between
+    processes on one host: readers only ever see complete files, and an
+    evicted file stays readable for whoever still has it open.
+    """
+
+    _index_filename = "index.sqlite"
+
+    def __init__(self, directory, max_size: int = 10 << 30):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, size INTEGER, atime REAL)"
+            )
+
+    def __len__(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _connect(self):
+        return closing(
+            sqlite3.connect(
+                self.directory / self._index_filename,
+                timeout=60,
+                isolation_level=None,
+            )
+        )
+
+    @staticmethod
+    def key(location, name, version):
+        return hashlib.sha256(f"{location}/{name}\0{version}".encode()).hexdigest()
+
+    def path(self, key):
+        return self.directory / key[:2] / key
+
+    def lookup(self, key):
+        path = self.path(key)
+        with self._connect() as db:
+            if not path.exists():
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE entries SET atime = ? WHERE key = ?", (time(), key))
+        return str(path)
+
+    def fill(self, key, fetch):
+        """Return the cached path of `key`, calling `fetch(tmpfile)` on a miss."""
+        path = self.lookup(key)
+        if path is not None:
+            return path
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        tmpfile = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            fetch(tmpfile)
+            size = os.path.getsize(tmpfile)
+            os.replace(tmpfile, path)
+        finally:
+            if os.path.exists(tmpfile):
+                os.unlink(tmpfile)
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, size, time())
+            )
+        self.evict(keep=key)
+        return str(path)
+
+    def evict(self, keep=None):
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+            total = total[0]
+            evicted = []
+            for key, size in db.execute(
+                "SELECT key, size FROM entries ORDER BY atime"
+            ).fetchall():
+                if total <= self.max_size:
+                    break
+                if key == keep:
+                    continue
+                evicted.append(key)
+                total -= size
+            db.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in evicted])
+            db.execute("COMMIT")
+        for key in evicted:
+            self.path(key).unlink(missing_ok=True)
+        return len(evicted)
+
+    def clear(self):
+        self.max_size, max_size = 0, self.max_size
+        try:
+            self.evict()
+        finally:
+            self.max_size = max_size
+
+    @staticmethod
+    def read(path, chunk_size=None):
+        with open(path, "rb") as file:
+            while True:
+                chunk = file.read(chunk_size or (1 << 20))
+                if not chunk:
+                    break
+                yield chunk
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from threading import RLock
+
+
+class _Entry:
+    __slots__ = ("value", "token", "generation")
+
+    def __init__(self, value, token, generation):
+        self.value = value
+        self.token = token
+        self.generation = generation
+
+
+class MetadataCache:
+    """
+    Bounded LRU cache of parsed metadata documents keyed by file location.
+
+    Entries loaded in the current generation are served without any I/O.
+    After `refresh()` bumps the generation, an entry is revalidated on its
+    next access by comparing the validator token (ETag, mtime, ...) and is
+    only reloaded when the token changed.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._mutex = RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, load, token):
+        if not self.maxsize:
+            return load()
+        with self._mutex:
+            entry = self._entries.get(key)
+            if entry is not None and entry.generation == self.generation:
+                self._entries.move_to_end(key)
+                return entry.value
+        if entry is not None and entry.token is not None:
+            current = token()
+            if current == entry.token:
+                with self._mutex:
+                    entry.generation = self.generation
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                return entry.value
+        else:
+            # The token is only fetched once an entry has to be revalidated,
+            # so short-lived instances pay a single read per document.
+            current = token() if entry is not None else None
+        value = load()
+        self.put(key, value, token=current)
+        return value
+
+    def put(self, key, value, token=None):
+        if not self.maxsize:
+            return
+        with self._mutex:
+            self._entries[key] = _Entry(value, token, self.generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def refresh(self):
+        with self._mutex:
+            self.generation += 1
+
+    def invalidate(self, key=None):
+        with self._mutex:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
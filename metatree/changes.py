@@ -0,0 +1,210 @@
+"""
+Append-only log of metadata changes below a tree root.
+
+Each record is a small file `.changes/<seq>` claimed with an exclusive
+create, so concurrent writers never share a sequence number and no backend
+needs an append operation. A reader tails the log by fetching the next
+sequence number until it appears.
+
+Sequence numbers are claimed contiguously, so the head of the log is found
+by probing forward from a `head` marker that writers refresh every
+`checkpoint` records, instead of listing the directory. A writer that loses
+a claim finds the head again the same way. `compact` removes
+old records and records the first remaining one in a `floor` marker.
+"""
+
+import asyncio
+
+from datetime import datetime
+from threading import Lock
+from time import monotonic, sleep, time
+
+
+def _modified(info):
+    """Modification time of `info` in seconds, None if the backend has none."""
+    for field in ("mtime", "LastModified", "modificationTime", "created"):
+        value = info.get(field)
+        if value is None:
+            continue
+        if isinstance(value, datetime):
+            return value.timestamp()
+        return float(value) / 1000 if field == "modificationTime" else float(value)
+    return None
+
+
+class ChangeLog:
+    _dirname = ".changes"
+    checkpoint = 64
+
+    def __init__(self, root, io_handler, fs, lease: float = 60.0):
+        self.root = root
+        self._io_handler = io_handler
+        self._fs = fs
+        self._lease = lease
+        self._head = None
+        self._mutex = Lock()
+
+    @property
+    def location(self):
+        return f"{self.root}/{self._dirname}"
+
+    def filepath(self, seq):
+        return f"{self.location}/{seq:012d}"
+
+    def _marker(self, name):
+        try:
+            marker = self._io_handler.to_dict(
+                self.location, filepath=f"{self.location}/{name}", fs=self._fs
+            )
+        except ValueError:
+            # Caught mid-write; markers are hints, so start lower.
+            return 0
+        return marker.get("seq", 0)
+
+    def _set_marker(self, name, seq):
+        self._io_handler.from_dict(
+            self.location,
+            dict(seq=seq),
+            filepath=f"{self.location}/{name}",
+            fs=self._fs,
+        )
+
+    def floor(self):
+        """Return the first sequence number that has not been compacted."""
+        return max(self._marker("floor"), 1)
+
+    def _claimed(self, seq):
+        return self._io_handler.exists(self.filepath(seq), fs=self._fs)
+
+    def head(self):
+        """Return the last sequence number in the log, 0 if it is empty."""
+        low = max(self._marker("head"), self.floor() - 1)
+        # Gallop past the marker, then bisect between the last claimed and
+        # the first unclaimed sequence number.
+        step = 1
+        while self._claimed(low + step):
+            low, step = low + step, step * 2
+        high = low + step
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self._claimed(middle):
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def append(self, record):
+        with self._mutex:
+            seq = (self.head() if self._head is None else self._head) + 1
+            while True:
+                try:
+                    self._io_handler.create(
+                        self.filepath(seq),
+                        self._io_handler.dumps(dict(record, seq=seq)),
+                        fs=self._fs,
+                    )
+                    break
+                except FileExistsError:
+                    # Another writer got there first. This writer may be far
+                    # behind, so find the head again instead of probing one
+                    # number at a time.
+                    seq = self.head() + 1
+            self._head = seq
+            if seq % self.checkpoint == 0:
+                self._set_marker("head", seq)
+            return seq
+
+    def _stale(self, info):
+        modified = _modified(info)
+        return modified is not None and modified + self._lease < time()
+
+    def _parse(self, seq, data):
+        try:
+            record = self._io_handler.loads(data)
+        except ValueError:
+            return None
+        # A record being created may be visible before its content.
+        return record if record.get("seq") == seq else None
+
+    def read(self, seq):
+        """
+        Return record `seq`, or None if it has not been written yet. A record
+        left incomplete for longer than the lease, by a writer that crashed
+        between claiming and writing it, reads as a `skip` record.
+        """
+        try:
+            record = self._parse(
+                seq, self._io_handler.cat(self.filepath(seq), fs=self._fs)
+            )
+            if record is None and self._stale(self._fs.info(self.filepath(seq))):
+                record = dict(seq=seq, op="skip")
+        except FileNotFoundError:
+            return None
+        return record
+
+    def _check_since(self, since):
+        if since is not None and since + 1 < self.floor():
+            raise Exception(f"Changes after {since} were compacted.")
+
+    def tail(self, since=None, poll_interval=1.0, timeout=None):
+        self._check_since(since)
+        seq = self.head() if since is None else since
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            record = self.read(seq + 1)
+            if record is not None:
+                seq += 1
+                deadline = None if timeout is None else monotonic() + timeout
+                if not record.get("op") == "skip":
+                    yield record
+                continue
+            if deadline is not None and monotonic() >= deadline:
+                return
+            sleep(poll_interval)
+
+    async def atail(self, run, since=None, poll_interval=1.0, timeout=None):
+        """`tail` driven by `run(method, *args)`, an async filesystem call."""
+        seq = self.head() if since is None else since
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            filepath = self.filepath(seq + 1)
+            try:
+                record = self._parse(seq + 1, await run("cat_file", filepath))
+                if record is None and self._stale(await run("info", filepath)):
+                    record = dict(seq=seq + 1, op="skip")
+            except FileNotFoundError:
+                record = None
+            if record is not None:
+                seq += 1
+                deadline = None if timeout is None else loop.time() + timeout
+                if not record.get("op") == "skip":
+                    yield record
+                continue
+            if deadline is not None and loop.time() >= deadline:
+                return
+            await asyncio.sleep(poll_interval)
+
+    def compact(self, keep: int):
+        """Remove all but the last `keep` records and return how many went."""
+        head = self.head()
+        floor = max(head - keep + 1, 1)
+        if floor <= self.floor():
+            return 0
+        # Readers learn about the gap before the records disappear.
+        self._set_marker("floor", floor)
+        self._set_marker("head", head)
+        names = self._io_handler.iterdir(self.location, fs=self._fs)
+        removed = [
+            f"{self.location}/{name}"
+            for name in names
+            if name.isdigit() and int(name) < floor
+        ]
+        if removed:
+            self._fs.rm(removed)
+        return len(removed)
+
+
+def matches(record, prefix):
+    path = record.get("path", "")
+    return not prefix or path == prefix or path.startswith(f"{prefix}/")
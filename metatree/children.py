@@ -0,0 +1,67 @@
+"""
+Sorted storage of a node's children.
+
+Children are kept sorted inline in `metadata["children"]`. Once a node has
+more than `page_size` children they are moved into page files, and the node
+metadata only keeps a `children_pages` header of `{"first", "count", "page"}`
+entries sorted by their first child. Membership costs one bisect over the
+header and one over a page; adding a child rewrites one page and the header.
+"""
+
+import uuid
+
+from bisect import bisect_left, bisect_right
+
+_page_prefix = ".children."
+
+
+def contains(children, child):
+    i = bisect_left(children, child)
+    return i < len(children) and children[i] == child
+
+
+def merge(children, new):
+    merged = list(children)
+    for child in sorted(set(new)):
+        i = bisect_left(merged, child)
+        if not (i < len(merged) and merged[i] == child):
+            merged.insert(i, child)
+    return merged
+
+
+def normalize(metadata):
+    """
+    Sort the children of a document written by an older version. The check is
+    one pass over a list that was just parsed; the sorted list is persisted
+    by the next write of the node.
+    """
+    children = metadata.get("children")
+    if isinstance(children, list) and any(
+        a > b for a, b in zip(children, children[1:])
+    ):
+        metadata["children"] = sorted(set(children))
+    return metadata
+
+
+def page_filename(page):
+    return f"{_page_prefix}{page}"
+
+
+def new_page(children):
+    return dict(first=children[0], count=len(children), page=uuid.uuid4().hex[:12])
+
+
+def page_index(pages, child):
+    firsts = [page.get("first") for page in pages]
+    return max(0, bisect_right(firsts, child) - 1)
+
+
+def split(children, page_size):
+    size = max(1, page_size // 2)
+    return [children[i : i + size] for i in range(0, len(children), size)]
+
+
+def page_slice(pages, start_after):
+    if start_after is None:
+        return pages
+    return pages[page_index(pages, start_after) :]
@@ -0,0 +1,2 @@
+class VersionConflictError(Exception):
+    """The metadata changed since the version a conditional update was based on."""
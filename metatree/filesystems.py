@@ -0,0 +1,122 @@
+"""
+Process-wide registry of fsspec filesystems.
+
+Metatree instances that point at the same backend with the same credentials
+share one filesystem, and with it the HTTP sessions and connection pools of
+s3fs, WebHDFS and HTTP. Short-lived instances therefore reuse warm
+connections instead of opening new ones.
+"""
+
+from threading import Lock
+
+import fsspec
+
+from fsspec.utils import tokenize
+
+# Keyword arguments consumed by Metatree itself; they are never passed on to
+# the filesystem constructor.
+_metatree_options = ("fs", "io_handler", "skip_init", "registry")
+
+
+class FileSystemRegistry:
+    """
+    Filesystem instances keyed by protocol and storage options.
+
+    `pool_size` bounds the HTTP connections kept per filesystem and
+    `keep_alive` is how long idle connections stay open, in seconds. Both
+    can be overridden per `get()` call. `close()` releases every session,
+    and the registry can be used as a context manager.
+    """
+
+    def __init__(self, pool_size: int = None, keep_alive: float = None):
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self._filesystems = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._filesystems)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, protocol, pool_size=None, keep_alive=None, **storage_options):
+        storage_options = {
+            k: v for k, v in storage_options.items() if k not in _metatree_options
+        }
+        pool_size = pool_size or self.pool_size
+        keep_alive = keep_alive or self.keep_alive
+        key = (protocol or "file", tokenize(pool_size, keep_alive, storage_options))
+        with self._lock:
+            fs = self._filesystems.get(key)
+            if fs is None:
+                fs = fsspec.filesystem(
+                    protocol or "file",
+                    skip_instance_cache=True,
+                    **_pool_options(protocol, pool_size, keep_alive, storage_options),
+                )
+                _mount_pool(fs, pool_size)
+                self._filesystems[key] = fs
+            return fs
+
+    def close(self):
+        with self._lock:
+            filesystems, self._filesystems = self._filesystems, {}
+        for fs in filesystems.values():
+            _close(fs)
+
+
+def _pool_options(protocol, pool_size, keep_alive, storage_options):
+    if protocol in ("s3", "s3a") and (pool_size or keep_alive):
+        config_kwargs = dict(storage_options.get("config_kwargs") or {})
+        if pool_size:
+            config_kwargs.setdefault("max_pool_connections", pool_size)
+        if keep_alive:
+            config_kwargs.setdefault("tcp_keepalive", True)
+        return dict(storage_options, config_kwargs=config_kwargs)
+    if protocol in ("http", "https") and (pool_size or keep_alive):
+
+        async def get_client(**kwargs):
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                limit=pool_size or 100, keepalive_timeout=keep_alive or 15
+            )
+            return aiohttp.ClientSession(connector=connector, **kwargs)
+
+        return dict(storage_options, get_client=get_client)
+    return storage_options
+
+
+def _mount_pool(fs, pool_size):
+    # WebHDFS talks through a blocking requests.Session.
+    session = getattr(fs, "session", None)
+    if pool_size and hasattr(session, "mount"):
+        from requests.adapters import HTTPAdapter
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+
+def _close(fs):
+    session = getattr(fs, "session", None)
+    if hasattr(session, "close"):
+        session.close()
+    for attr in ("_session", "_s3"):
+        client = getattr(fs, attr, None)
+        close_session = getattr(fs, "close_session", None)
+        if client is not None and close_session is not None:
+            close_session(getattr(fs, "loop", None), client)
+            setattr(fs, attr, None)
+
+
+registry = FileSystemRegistry()
+
+
+def filesystem(protocol, **storage_options):
+    """Return the shared filesystem for `protocol` from the default registry."""
+    return registry.get(protocol, **storage_options)
@@ -0,0 +1,68 @@
+"""
+Materialized attribute index of a tree, stored in `.index` under the root.
+
+The document holds `postings`, mapping each attribute to its values and the
+sorted paths carrying them, and `attributes`, the reverse map from a path to
+its indexed attributes, so a node is re-indexed without scanning every
+posting list.
+"""
+
+from bisect import bisect_left, insort
+
+_unindexed = ("children", "_version", "_created")
+
+
+def indexed_items(metadata):
+    return {
+        k: str(v)
+        for k, v in metadata.items()
+        if k not in _unindexed and isinstance(v, (str, int, float, bool))
+    }
+
+
+def load_index(document):
+    """Return `(postings, attributes)` of an index document."""
+    if set(document) == {"postings", "attributes"}:
+        return document["postings"], document["attributes"]
+    # Written before the reverse map existed: the document is the postings.
+    attributes = {}
+    for attribute, values in document.items():
+        for value, paths in values.items():
+            for path in paths:
+                attributes.setdefault(path, {})[attribute] = value
+    return document, attributes
+
+
+def dump_index(postings, attributes):
+    return dict(postings=postings, attributes=attributes)
+
+
+def is_indexed(attributes, path, metadata):
+    return attributes.get(path, {}) == indexed_items(metadata)
+
+
+def index_node(postings, attributes, path, metadata):
+    """Replace the postings of `path` with the attributes of `metadata`."""
+    items = indexed_items(metadata)
+    for attribute, value in attributes.pop(path, {}).items():
+        paths = postings.get(attribute, {}).get(value, [])
+        i = bisect_left(paths, path)
+        if i < len(paths) and paths[i] == path:
+            del paths[i]
+        if not paths:
+            postings.get(attribute, {}).pop(value, None)
+        if not postings.get(attribute, True):
+            del postings[attribute]
+    for attribute, value in items.items():
+        insort(postings.setdefault(attribute, {}).setdefault(value, []), path)
+    if items:
+        attributes[path] = items
+    return postings
+
+
+def query_index(postings, filters):
+    matched = None
+    for attribute, value in filters.items():
+        paths = set(postings.get(attribute, {}).get(str(value), []))
+        matched = paths if matched is None else matched & paths
+    return sorted(matched or [])
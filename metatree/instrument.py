@@ -0,0 +1,233 @@
+"""
+Timing and call counting of Metatree and IOHandler operations.
+
+Instrumented functions report to every enabled `Instrument`. With none
+enabled, a call only pays one extra function call and a list check.
+
+    recorder = Recorder()
+    with instrumentation(recorder):
+        metatree.find("my-awful-model/v2")
+    recorder.stats["io.exists"]
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+from inspect import isgeneratorfunction
+from threading import local
+from time import perf_counter
+
+_instruments = []
+_local = local()
+
+
+class Instrument:
+    """
+    Receives the start and end of every instrumented call.
+
+    `parent` is the enclosing instrumented operation of the same thread,
+    e.g. `find` for the `io.exists` calls it makes. Whatever `start` returns
+    is handed back to `finish` as `context`.
+    """
+
+    def start(self, operation, parent):
+        return None
+
+    def finish(self, operation, parent, context, seconds, nbytes=None, error=None):
+        pass
+
+
+class Recorder(Instrument):
+    """Aggregates calls, errors, seconds and bytes per operation in memory."""
+
+    def __init__(self):
+        self.stats = {}
+        self.calls_by_parent = {}
+
+    def finish(self, operation, parent, context, seconds, nbytes=None, error=None):
+        stats = self.stats.setdefault(
+            operation, dict(calls=0, errors=0, seconds=0.0, bytes=0)
+        )
+        stats["calls"] += 1
+        stats["errors"] += error is not None
+        stats["seconds"] += seconds
+        stats["bytes"] += nbytes or 0
+        if parent is not None:
+            key = (parent, operation)
+            self.calls_by_parent[key] = self.calls_by_parent.get(key, 0) + 1
+
+    def reset(self):
+        self.stats.clear()
+        self.calls_by_parent.clear()
+
+
+class PrometheusInstrument(Instrument):
+    """Exports `<prefix>_calls_total`, `<prefix>_seconds` and `<prefix>_bytes_total`."""
+
+    def __init__(self, registry=None, prefix="metatree"):
+        from prometheus_client import REGISTRY, Counter, Histogram
+
+        registry = registry or REGISTRY
+        self.calls = Counter(
+            f"{prefix}_calls",
+            "Instrumented calls.",
+            ("operation", "status"),
+            registry=registry,
+        )
+        self.seconds = Histogram(
+            f"{prefix}_seconds",
+            "Duration of instrumented calls.",
+            ("operation",),
+            registry=registry,
+        )
+        self.bytes = Counter(
+            f"{prefix}_bytes",
+            "Bytes moved by instrumented calls.",
+            ("operation",),
+            registry=registry,
+        )
+
+    def finish(self, operation, parent, context, seconds, nbytes=None, error=None):
+        status = "ok" if error is None else "error"
+        self.calls.labels(operation, status).inc()
+        self.seconds.labels(operation).observe(seconds)
+        if nbytes:
+            self.bytes.labels(operation).inc(nbytes)
+
+
+class OpenTelemetryInstrument(Instrument):
+    """Opens one span per call; nested calls become child spans."""
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("metatree")
+
+    def start(self, operation, parent):
+        span = self.tracer.start_span(operation)
+        scope = self._trace.use_span(span, end_on_exit=False)
+        scope.__enter__()
+        return span, scope
+
+    def finish(self, operation, parent, context, seconds, nbytes=None, error=None):
+        span, scope = context
+        if nbytes is not None:
+            span.set_attribute("metatree.bytes", nbytes)
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(self._trace.Status(self._trace.StatusCode.ERROR))
+        scope.__exit__(None, None, None)
+        span.end()
+
+
+def enable(instrument: Instrument):
+    _instruments.append(instrument)
+    return instrument
+
+
+def disable(instrument: Instrument = None):
+    if instrument is None:
+        _instruments.clear()
+    elif instrument in _instruments:
+        _instruments.remove(instrument)
+
+
+@contextmanager
+def instrumentation(instrument: Instrument):
+    enable(instrument)
+    try:
+        yield instrument
+    finally:
+        disable(instrument)
+
+
+def _nbytes(args, kwargs, result):
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if isinstance(result, dict) and isinstance(result.get("size"), int):
+        return result.get("size")
+    for value in (*args, *kwargs.values()):
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+    return None
+
+
+def add_bytes(nbytes):
+    """Report bytes moved by the innermost instrumented call of this thread."""
+    sizes = getattr(_local, "sizes", None)
+    if sizes:
+        sizes[-1] += nbytes
+
+
+def _finish(instruments, contexts, operation, parent, seconds, nbytes, error):
+    for instrument, context in reversed(list(zip(instruments, contexts))):
+        instrument.finish(operation, parent, context, seconds, nbytes, error)
+
+
+def _iterate(operation, parent, chunks):
+    # Runs from the first chunk to the last, so the transfer is timed even
+    # though the instrumented call itself returned before it started.
+    instruments = list(_instruments)
+    contexts = [i.start(operation, parent) for i in instruments]
+    nbytes, error = 0, None
+    started = perf_counter()
+    try:
+        for chunk in chunks:
+            nbytes += len(chunk)
+            yield chunk
+    except GeneratorExit:
+        raise
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        seconds = perf_counter() - started
+        _finish(instruments, contexts, operation, parent, seconds, nbytes, error)
+
+
+def instrumented(operation):
+    def decorator(func):
+        if isgeneratorfunction(func):
+
+            @wraps(func)
+            def generator(*args, **kwargs):
+                if not _instruments:
+                    return func(*args, **kwargs)
+                stack = getattr(_local, "stack", None)
+                parent = stack[-1] if stack else None
+                return _iterate(operation, parent, func(*args, **kwargs))
+
+            return generator
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _instruments:
+                return func(*args, **kwargs)
+            stack = getattr(_local, "stack", None)
+            if stack is None:
+                stack = _local.stack = []
+                _local.sizes = []
+            parent = stack[-1] if stack else None
+            instruments = list(_instruments)
+            contexts = [i.start(operation, parent) for i in instruments]
+            stack.append(operation)
+            _local.sizes.append(0)
+            result, error = None, None
+            started = perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                seconds = perf_counter() - started
+                stack.pop()
+                nbytes = _local.sizes.pop() or _nbytes(args, kwargs, result)
+                _finish(
+                    instruments, contexts, operation, parent, seconds, nbytes, error
+                )
+
+        return wrapper
+
+    return decorator
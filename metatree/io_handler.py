@@ -1,15 +1,48 @@
+import asyncio
 import fsspec
+import hashlib
 import json
+import os
+import uuid
 
+from concurrent.futures import ThreadPoolExecutor
+from fsspec.asyn import sync
 from os.path import basename
+from pathlib import Path
+from threading import Lock
+from time import time
+
+from .children import normalize
+from .errors import VersionConflictError
+from .instrument import add_bytes, instrumented
+from .packed import packb, unpackb
+from .util import file_checksum, iter_chunks, local_size
 
 
 class IOHandler:
     _metadata_filename = "metadata.json"
+    _chunk_size = 1 << 20
+    _block_size = 8 << 20
+    _blob_dirname = ".blobs"
+    _reserved_prefixes = (
+        ".lock",
+        ".metatree",
+        ".index",
+        ".journal",
+        ".blobs",
+        ".children",
+        ".changes",
+        ".generation",
+        ".intents",
+    )
+    _conditional_writes = False
+    _token_fields = ("ETag", "etag", "mtime", "modificationTime", "LastModified")
 
     @classmethod
-    def read(cls, location, chunk_size=8192, fs: fsspec.AbstractFileSystem = None):
-        with fs.open(location, "rb") as file:
+    @instrumented("io.read")
+    def read(cls, location, chunk_size=None, fs: fsspec.AbstractFileSystem = None):
+        chunk_size = chunk_size or cls._chunk_size
+        with fs.open(location, "rb", block_size=chunk_size) as file:
             while True:
                 chunk = file.read(chunk_size)
                 if not chunk:
@@ -17,44 +50,320 @@ class IOHandler:
                 yield chunk
 
     @classmethod
+    @instrumented("io.iterdir")
     def iterdir(cls, location, fs):
         return [basename(l.get("name")) for l in fs.listdir(location)]
 
     @classmethod
+    @instrumented("io.copy")
     def copy(cls, location, filepath, fs: fsspec.AbstractFileSystem, recursive=False):
         dst = f"{location}/{basename(filepath)}"
         fs.put(str(filepath), dst, recursive=recursive)
+        add_bytes(local_size(filepath))
         return cls.exists(dst, fs=fs)
 
     @classmethod
+    @instrumented("io.upload")
+    def upload(cls, location, filepath, fs: fsspec.AbstractFileSystem, recursive=False):
+        """Copy `filepath` into `location` and return its manifest entry."""
+        dst = f"{location}/{basename(filepath)}"
+        fs.put(str(filepath), dst, recursive=recursive)
+        try:
+            info = fs.info(dst)
+        except FileNotFoundError:
+            return None
+        if info.get("type") == "directory":
+            add_bytes(local_size(filepath))
+            return dict(type="directory", mtime=time())
+        return dict(
+            size=info.get("size"), checksum=file_checksum(filepath), mtime=time()
+        )
+
+    @classmethod
+    @instrumented("io.upload_blob")
+    def upload_blob(cls, root, filepath, fs: fsspec.AbstractFileSystem):
+        """
+        Store `filepath` under its sha256 digest below `root` and return its
+        manifest entry. The upload is skipped when the blob already exists.
+        """
+        checksum = file_checksum(filepath)
+        digest = checksum.split(":", 1)[1]
+        blob = f"{cls._blob_dirname}/{digest[:2]}/{digest}"
+        if not fs.exists(f"{root}/{blob}"):
+            fs.makedirs(f"{root}/{cls._blob_dirname}/{digest[:2]}", exist_ok=True)
+            # Readers treat an existing blob as complete, so it is uploaded
+            # under a temporary name first.
+            partial = f"{root}/{blob}.{uuid.uuid4().hex}"
+            fs.put_file(str(filepath), partial)
+            fs.mv(partial, f"{root}/{blob}")
+        return dict(
+            size=Path(filepath).stat().st_size,
+            checksum=checksum,
+            mtime=time(),
+            blob=blob,
+        )
+
+    @classmethod
+    def _write_chunks(cls, file, source):
+        digest, size = hashlib.sha256(), 0
+        for chunk in iter_chunks(source, cls._chunk_size):
+            file.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+        return size, f"sha256:{digest.hexdigest()}"
+
+    @classmethod
+    @instrumented("io.upload_stream")
+    def upload_stream(
+        cls, location, name, source, fs: fsspec.AbstractFileSystem, block_size=None
+    ):
+        """
+        Write `source` to `location/name` and return its manifest entry. On
+        backends honouring `autocommit=False` (local, S3, WebHDFS) the file
+        only appears once complete; elsewhere a failed stream removes what
+        was written. On S3 `block_size` is the multipart part size.
+        """
+        dst = f"{location}/{name}"
+        file = fs.open(
+            dst, "wb", block_size=block_size or cls._block_size, autocommit=False
+        )
+        try:
+            size, checksum = cls._write_chunks(file, source)
+            file.close()
+        except BaseException:
+            file.discard()
+            # memory:// ignores autocommit and exposes the partial file.
+            if fs.exists(dst):
+                fs.rm(dst)
+            raise
+        file.commit()
+        return dict(size=size, checksum=checksum, mtime=time())
+
+    @classmethod
+    @instrumented("io.upload_blob_stream")
+    def upload_blob_stream(
+        cls, root, source, fs: fsspec.AbstractFileSystem, block_size=None
+    ):
+        """
+        `upload_blob` for a stream. The digest is only known at the end, so
+        the stream is written under a temporary name and moved into place.
+        """
+        fs.makedirs(f"{root}/{cls._blob_dirname}", exist_ok=True)
+        partial = f"{root}/{cls._blob_dirname}/.partial-{uuid.uuid4().hex}"
+        try:
+            with fs.open(
+                partial, "wb", block_size=block_size or cls._block_size
+            ) as file:
+                size, checksum = cls._write_chunks(file, source)
+            digest = checksum.split(":", 1)[1]
+            blob = f"{cls._blob_dirname}/{digest[:2]}/{digest}"
+            if fs.exists(f"{root}/{blob}"):
+                fs.rm(partial)
+            else:
+                fs.makedirs(f"{root}/{cls._blob_dirname}/{digest[:2]}", exist_ok=True)
+                fs.mv(partial, f"{root}/{blob}")
+        except BaseException:
+            if fs.exists(partial):
+                fs.rm(partial)
+            raise
+        return dict(size=size, checksum=checksum, mtime=time(), blob=blob)
+
+    @classmethod
+    @instrumented("io.scan")
+    def scan(cls, location, fs: fsspec.AbstractFileSystem):
+        """Build manifest entries for the files already stored in `location`."""
+        entries = {}
+        for info in fs.ls(location, detail=True):
+            name = basename(info.get("name").rstrip("/"))
+            if name.startswith((cls._metadata_filename, *cls._reserved_prefixes)):
+                continue
+            if info.get("type") == "directory":
+                entries[name] = dict(type="directory", mtime=info.get("mtime"))
+            else:
+                entries[name] = dict(size=info.get("size"), mtime=info.get("mtime"))
+        return entries
+
+    @classmethod
+    @instrumented("io.download")
+    def download(
+        cls,
+        location,
+        outfile,
+        fs: fsspec.AbstractFileSystem,
+        recursive=False,
+        block_size=None,
+        max_workers=8,
+    ):
+        block_size = block_size or cls._block_size
+        if not (recursive and fs.isdir(location)):
+            add_bytes(
+                cls._download_file(location, outfile, fs, block_size, max_workers)
+            )
+            return
+        prefix = fs._strip_protocol(location).rstrip("/")
+        files = fs.find(location)
+        for remote in files:
+            Path(f"{outfile}{remote[len(prefix):]}").parent.mkdir(
+                parents=True, exist_ok=True
+            )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            sizes = list(
+                executor.map(
+                    lambda remote: cls._download_file(
+                        remote, f"{outfile}{remote[len(prefix):]}", fs, block_size, 1
+                    ),
+                    files,
+                )
+            )
+        add_bytes(sum(sizes))
+
+    @classmethod
+    def _download_file(cls, location, outfile, fs, block_size, max_workers):
+        """Fetch one file and return its size."""
+        size = fs.size(location)
+        if max_workers <= 1 or size is None or size <= block_size:
+            fs.get_file(location, outfile)
+            return local_size(outfile)
+        # Ranged reads land in a preallocated file with positional writes, so
+        # blocks can complete in any order without a shared file offset.
+        with open(outfile, "wb") as file:
+            file.truncate(size)
+        fd = os.open(outfile, os.O_WRONLY)
+        mutex = Lock()
+
+        def fetch(start):
+            data = fs.cat_file(location, start=start, end=min(start + block_size, size))
+            if hasattr(os, "pwrite"):
+                os.pwrite(fd, data, start)
+            else:
+                with mutex:
+                    os.lseek(fd, start, os.SEEK_SET)
+                    os.write(fd, data)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(fetch, range(0, size, block_size)))
+        finally:
+            os.close(fd)
+        return size
+
+    @classmethod
+    @instrumented("io.mkdir")
     def mkdir(cls, location, fs: fsspec.AbstractFileSystem):
-        return fs.mkdir(location, exist_ok=True)
+        return fs.makedirs(location, exist_ok=True)
 
     @classmethod
+    @instrumented("io.touch")
     def touch(cls, location, fs: fsspec.AbstractFileSystem):
         return fs.touch(location)
 
     @classmethod
+    @instrumented("io.unlink")
     def unlink(cls, location, fs: fsspec.AbstractFileSystem):
         return fs.rm(location)
 
     @classmethod
+    @instrumented("io.exists")
     def exists(cls, location, fs: fsspec.AbstractFileSystem):
         return fs.exists(location)
 
     @classmethod
+    @instrumented("io.cat")
+    def cat(cls, location, fs: fsspec.AbstractFileSystem):
+        return fs.cat_file(location)
+
+    @classmethod
+    @instrumented("io.cat_many")
+    def cat_many(cls, locations, fs: fsspec.AbstractFileSystem, max_workers=8):
+        """Read many files concurrently; failed reads are returned as exceptions."""
+        if getattr(fs, "async_impl", False) and not fs.asynchronous:
+
+            async def gather(coroutines):
+                return await asyncio.gather(*coroutines, return_exceptions=True)
+
+            return sync(
+                fs.loop, gather, [fs._cat_file(location) for location in locations]
+            )
+
+        def cat(location):
+            try:
+                return cls.cat(location, fs=fs)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(cat, locations))
+
+    @classmethod
+    @instrumented("io.to_dicts")
+    def to_dicts(cls, locations, fs: fsspec.AbstractFileSystem, max_workers=8):
+        results = cls.cat_many(
+            [f"{location}/{cls._metadata_filename}" for location in locations],
+            fs=fs,
+            max_workers=max_workers,
+        )
+        for result in results:
+            if isinstance(result, Exception) and not isinstance(
+                result, FileNotFoundError
+            ):
+                raise result
+        return [
+            (
+                {}
+                if isinstance(result, FileNotFoundError)
+                else normalize(cls.loads(result))
+            )
+            for result in results
+        ]
+
+    @classmethod
+    @instrumented("io.write")
+    def write(cls, location, data: bytes, fs: fsspec.AbstractFileSystem):
+        return fs.pipe_file(location, data)
+
+    @classmethod
+    @instrumented("io.create")
+    def create(cls, location, data: bytes, fs: fsspec.AbstractFileSystem):
+        """Write `data` only if `location` is absent, else raise FileExistsError."""
+        return fs.pipe_file(location, data, mode="create")
+
+    @classmethod
+    def _fresh_info(cls, location, fs: fsspec.AbstractFileSystem):
+        # Validators must not come from a listings cache filled by iterdir.
+        fs.invalidate_cache(location)
+        return fs.info(location)
+
+    @classmethod
+    @instrumented("io.etag")
+    def etag(cls, location, fs: fsspec.AbstractFileSystem):
+        return cls._fresh_info(location, fs).get("ETag")
+
+    @classmethod
+    @instrumented("io.token")
+    def token(cls, location, fs: fsspec.AbstractFileSystem):
+        try:
+            info = cls._fresh_info(location, fs)
+        except FileNotFoundError:
+            return None
+        for field in cls._token_fields:
+            if info.get(field) is not None:
+                return (str(info.get(field)), info.get("size"))
+        return None
+
+    @classmethod
+    @instrumented("io.to_dict")
     def to_dict(cls, location, filepath=None, fs: fsspec.AbstractFileSystem = None):
         if filepath is None:
             filepath = f"{location}/{cls._metadata_filename}"
         try:
-            with fs.open(filepath, "rt") as file:
-                return json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
+            return normalize(cls.loads(cls.cat(filepath, fs=fs)))
+        except FileNotFoundError:
             return {}
         except Exception as e:
             raise e
 
     @classmethod
+    @instrumented("io.from_dict")
     def from_dict(
         cls,
         location,
@@ -64,18 +373,97 @@ class IOHandler:
     ):
         if filepath is None:
             filepath = f"{location}/{cls._metadata_filename}"
-        with fs.open(filepath, "w") as file:
-            json.dump(metadata, file)
+        data = cls.dumps(metadata)
+        with fs.open(filepath, "wb") as file:
+            file.write(data)
+        add_bytes(len(data))
 
+    @classmethod
+    def loads(cls, data: bytes):
+        try:
+            return json.loads(data)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return {}
+
+    @classmethod
+    def dumps(cls, metadata) -> bytes:
+        return json.dumps(metadata).encode()
 
-class LocalJsonHandler(IOHandler): ...
+
+class LocalJsonHandler(IOHandler):
+    @classmethod
+    @instrumented("io.create")
+    def create(cls, location, data: bytes, fs: fsspec.AbstractFileSystem):
+        with fs.open(location, "xb") as file:
+            file.write(data)
 
 
-class WebHdfsJsonHandler(IOHandler): ...
+class WebHdfsJsonHandler(IOHandler):
+    @classmethod
+    @instrumented("io.create")
+    def create(cls, location, data: bytes, fs: fsspec.AbstractFileSystem):
+        try:
+            out = fs._call("CREATE", "put", location, redirect=False, overwrite="false")
+        except RuntimeError as e:
+            if "FileAlreadyExists" in str(e):
+                raise FileExistsError(location) from e
+            raise e
+        out = fs.session.put(
+            fs._apply_proxy(out.headers["Location"]),
+            data=data,
+            headers={"content-type": "application/octet-stream"},
+        )
+        out.raise_for_status()
 
 
 class LocalYamlHandler(LocalJsonHandler):
     _metadata_filename = "metadata.yml"
 
 
-class S3JsonHandler(IOHandler): ...
+class PackedIOHandler(IOHandler):
+    """Stores metadata in the compact binary encoding of `metatree.packed`."""
+
+    _metadata_filename = "metadata.bin"
+
+    @classmethod
+    def loads(cls, data: bytes):
+        try:
+            return unpackb(data)
+        except (ValueError, IndexError, UnicodeDecodeError):
+            return {}
+
+    @classmethod
+    def dumps(cls, metadata) -> bytes:
+        if isinstance(metadata.get("children"), list):
+            metadata = dict(metadata, children=sorted(metadata.get("children")))
+        return packb(metadata)
+
+
+class LocalPackedHandler(PackedIOHandler, LocalJsonHandler): ...
+
+
+class WebHdfsPackedHandler(PackedIOHandler, WebHdfsJsonHandler): ...
+
+
+class MemoryJsonHandler(IOHandler): ...
+
+
+class S3JsonHandler(IOHandler):
+    # s3fs maps mode="create" to a conditional put (If-None-Match: *).
+    _conditional_writes = True
+
+    @classmethod
+    @instrumented("io.write_if_match")
+    def write_if_match(cls, location, data: bytes, etag, fs: fsspec.AbstractFileSystem):
+        try:
+            fs.pipe_file(location, data, IfMatch=etag)
+        except Exception as e:
+            if "PreconditionFailed" in str(e) or "ConditionalRequestConflict" in str(e):
+                raise VersionConflictError(f"Metadata ({location}) changed.") from e
+            raise
+
+
+class MemoryPackedHandler(PackedIOHandler, MemoryJsonHandler): ...
+
+
+class S3PackedHandler(PackedIOHandler, S3JsonHandler): ...
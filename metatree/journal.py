@@ -0,0 +1,68 @@
+import json
+import uuid
+
+
+class Transaction:
+    """Metadata writes collected in memory until the transaction commits."""
+
+    _journal_dirname = ".journal"
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.writes = {}
+        self.changes = []
+        # Stored `_version` of each node document when it was first written.
+        self.bases = {}
+
+    def __bool__(self):
+        return bool(self.writes or self.changes)
+
+    def record(self, location, filepath, metadata, base=None):
+        self.writes[filepath] = (location, metadata)
+        if base is not None:
+            self.bases.setdefault(filepath, base)
+
+    def lookup(self, filepath):
+        location, metadata = self.writes.get(filepath, (None, None))
+        return metadata
+
+    def common_location(self, root):
+        common = None
+        for location, _ in self.writes.values():
+            parts = location.split("/")
+            if common is None:
+                common = parts
+                continue
+            size = 0
+            while size < min(len(common), len(parts)) and common[size] == parts[size]:
+                size += 1
+            common = common[:size]
+        location = "/".join(common or [])
+        return location if location.startswith(root) else root
+
+    def journal(self, root):
+        return f"{root}/{self._journal_dirname}/{self.id}"
+
+    def dumps(self, location):
+        return json.dumps(
+            dict(
+                id=self.id,
+                location=location,
+                writes=[
+                    [location, filepath, metadata]
+                    for filepath, (location, metadata) in self.writes.items()
+                ],
+                changes=self.changes,
+            )
+        ).encode()
+
+    @classmethod
+    def loads(cls, data):
+        """Return `(location, transaction)`; a torn journal raises ValueError."""
+        journal = json.loads(data)
+        transaction = cls()
+        transaction.id = journal["id"]
+        for location, filepath, metadata in journal["writes"]:
+            transaction.record(location, filepath, metadata)
+        transaction.changes = journal.get("changes", [])
+        return journal["location"], transaction
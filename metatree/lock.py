@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import random
+import socket
+import uuid
+
+from time import monotonic, sleep, time
+
+from .instrument import instrumented
+
+
+def new_owner_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class LeaseLock:
+    """
+    Lock file acquired with an atomic create-if-absent.
+
+    The file records its owner and the lease expiry, so a lock left behind
+    by a crashed writer can be broken once the lease has run out. Waiting
+    uses exponential backoff with jitter.
+    """
+
+    def __init__(
+        self,
+        location,
+        io_handler,
+        fs,
+        lease: float = 60.0,
+        timeout: float = 20.0,
+        backoff: float = 0.005,
+        max_backoff: float = 1.0,
+        owner: str = None,
+    ):
+        self.location = location
+        self.io_handler = io_handler
+        self.fs = fs
+        self.lease = lease
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.owner = owner or new_owner_id()
+        self.acquired = False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _payload(self):
+        return json.dumps(dict(owner=self.owner, expires=time() + self.lease)).encode()
+
+    def try_acquire(self):
+        try:
+            self.io_handler.create(self.location, self._payload(), fs=self.fs)
+        except FileExistsError:
+            return False
+        self.acquired = True
+        return True
+
+    @instrumented("lock.lease")
+    def acquire(self):
+        deadline = monotonic() + self.timeout
+        attempts = 0
+        while not self.try_acquire():
+            if self.break_if_stale():
+                continue
+            if monotonic() > deadline:
+                raise Exception(f"lock failed. ({self.location})")
+            delay = min(self.max_backoff, self.backoff * 2**attempts)
+            sleep(random.uniform(delay / 2, delay))
+            attempts += 1
+        return True
+
+    def renew(self):
+        if not self.acquired:
+            raise Exception(f"Lock ({self.location}) is not held.")
+        self.io_handler.write(self.location, self._payload(), fs=self.fs)
+
+    def release(self):
+        if not self.acquired:
+            return
+        self.acquired = False
+        if self.holder().get("owner") in (self.owner, None):
+            try:
+                self.io_handler.unlink(self.location, fs=self.fs)
+            except FileNotFoundError:
+                pass
+
+    def holder(self, location=None):
+        location = location or self.location
+        try:
+            holder = json.loads(self.io_handler.cat(location, fs=self.fs))
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            # Empty lock files are left by older versions which only touched
+            # the lock; their lease runs from the file's modification time.
+            holder = {}
+        if not isinstance(holder, dict):
+            holder = {}
+        if holder.get("expires") is None:
+            try:
+                mtime = self.fs.info(location).get("mtime")
+            except FileNotFoundError:
+                return {}
+            if mtime is not None:
+                holder["expires"] = float(mtime) + self.lease
+        return holder
+
+    def break_if_stale(self):
+        """
+        Remove the lock if its lease has run out and return whether it is
+        gone. The lock is first moved to a tombstone of this breaker's own,
+        so of several breakers only one takes any given lock file. A lock
+        that another writer acquired again in the meantime is put back.
+        """
+        holder = self.holder()
+        expires = holder.get("expires")
+        if expires is None or expires > time():
+            return False
+        tombstone = f"{self.location}.stale.{uuid.uuid4().hex}"
+        try:
+            self.fs.mv(self.location, tombstone)
+        except FileNotFoundError:
+            # Another writer broke it first.
+            return True
+        moved = self.holder(tombstone)
+        if (
+            moved.get("owner") == holder.get("owner")
+            and moved.get("expires") == expires
+        ):
+            logging.warning(
+                f"Breaking stale lock ({self.location}) of {holder.get('owner')}."
+            )
+            self.io_handler.unlink(tombstone, fs=self.fs)
+            return True
+        try:
+            self.io_handler.create(
+                self.location, self.io_handler.cat(tombstone, fs=self.fs), fs=self.fs
+            )
+        except FileExistsError:
+            logging.warning(
+                f"Lock ({self.location}) of {moved.get('owner')} was lost "
+                "while breaking a stale lock."
+            )
+        self.io_handler.unlink(tombstone, fs=self.fs)
+        return False
+
+
+class NodeLock:
+    """
+    Exclusive lock on one node of the tree plus intent locks on its ancestors.
+
+    Writers to disjoint subtrees only share intent locks, which never conflict
+    with each other. An exclusive lock conflicts with an exclusive lock on an
+    ancestor and with intent locks left on the node by writers below it. Both
+    sides publish their lock before checking for the other, so at least one
+    of two conflicting writers always backs off. Intents are kept under
+    `.intents/` in each node, so the check lists them without the children.
+    """
+
+    _exclusive_filename = ".lock"
+    _intent_dirname = ".intents"
+
+    def __init__(
+        self,
+        location,
+        ancestors,
+        io_handler,
+        fs,
+        lease: float = 60.0,
+        timeout: float = 20.0,
+        backoff: float = 0.005,
+        max_backoff: float = 1.0,
+        owner: str = None,
+    ):
+        self.location = location
+        self.ancestors = list(ancestors)
+        self.io_handler = io_handler
+        self.fs = fs
+        self.lease = lease
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.owner = owner or new_owner_id()
+        self.intent_name = uuid.uuid4().hex
+        self.exclusive = self._lease_lock(location, timeout=0)
+        self._intents = []
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    @property
+    def acquired(self):
+        return self.exclusive.acquired
+
+    def _lease_lock(self, location, **kwargs):
+        return LeaseLock(
+            f"{location}/{self._exclusive_filename}",
+            self.io_handler,
+            self.fs,
+            **dict(dict(lease=self.lease, owner=self.owner), **kwargs),
+        )
+
+    def _payload(self):
+        return json.dumps(dict(owner=self.owner, expires=time() + self.lease)).encode()
+
+    def _intent_expired(self, location):
+        try:
+            holder = json.loads(self.io_handler.cat(location, fs=self.fs))
+        except FileNotFoundError:
+            return True
+        except ValueError:
+            return False
+        if holder.get("expires", float("inf")) > time():
+            return False
+        try:
+            self.io_handler.unlink(location, fs=self.fs)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _write_intent(self, ancestor, payload):
+        intent = f"{ancestor}/{self._intent_dirname}/{self.intent_name}"
+        try:
+            self.io_handler.write(intent, payload, fs=self.fs)
+        except FileNotFoundError:
+            # Local and HDFS need the directory; object stores have none.
+            self.io_handler.mkdir(f"{ancestor}/{self._intent_dirname}", fs=self.fs)
+            self.io_handler.write(intent, payload, fs=self.fs)
+        return intent
+
+    def _foreign_intents(self):
+        location = f"{self.location}/{self._intent_dirname}"
+        try:
+            names = self.io_handler.iterdir(location, fs=self.fs)
+        except FileNotFoundError:
+            return False
+        return any(not self._intent_expired(f"{location}/{name}") for name in names)
+
+    def _release_intents(self):
+        intents, self._intents = self._intents, []
+        if intents:
+            try:
+                self.fs.rm(intents)
+            except FileNotFoundError:
+                pass
+
+    def try_acquire(self):
+        payload = self._payload()
+        for ancestor in self.ancestors:
+            self._intents.append(self._write_intent(ancestor, payload))
+            exclusive = self._lease_lock(ancestor)
+            if self.io_handler.exists(exclusive.location, fs=self.fs):
+                if not exclusive.break_if_stale():
+                    self._release_intents()
+                    return False
+        if not self.exclusive.try_acquire():
+            if not (self.exclusive.break_if_stale() and self.exclusive.try_acquire()):
+                self._release_intents()
+                return False
+        if self._foreign_intents():
+            self.exclusive.release()
+            self._release_intents()
+            return False
+        return True
+
+    @instrumented("lock.wait")
+    def acquire(self):
+        deadline = monotonic() + self.timeout
+        attempts = 0
+        while not self.try_acquire():
+            if monotonic() > deadline:
+                raise Exception(f"lock failed. ({self.location})")
+            delay = min(self.max_backoff, self.backoff * 2**attempts)
+            sleep(random.uniform(delay / 2, delay))
+            attempts += 1
+        return True
+
+    def release(self):
+        self.exclusive.release()
+        self._release_intents()
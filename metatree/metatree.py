@@ -1,17 +1,56 @@
 import logging
+import shutil
+import uuid
 
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from itertools import islice
 from pathlib import Path
-from time import sleep
+from threading import local
+from time import time
 from urllib.parse import urlparse
 
 import fsspec
 
+from fsspec.implementations.local import LocalFileSystem
+
+from .artifacts import ArtifactCache
+from .cache import MetadataCache
+from .retention import plan
+from .replica import Replica
+from .packed import packb
+from .snapshot import Snapshot, SnapshotWriter, join
+from .changes import ChangeLog, matches
+from .errors import VersionConflictError
+from .filesystems import registry
+from .children import (
+    contains,
+    merge,
+    new_page,
+    page_filename,
+    page_index,
+    page_slice,
+    split,
+)
 from .io_handler import (
     LocalJsonHandler,
+    MemoryJsonHandler,
     WebHdfsJsonHandler,
     S3JsonHandler,
 )
-from .util import with_lock, resolve_file_url
+from .index import dump_index, index_node, is_indexed, load_index, query_index
+from .instrument import instrumented
+from .journal import Transaction
+from .lock import LeaseLock, NodeLock
+from .util import (
+    file_checksum,
+    hidden_keys,
+    map_file,
+    public_metadata,
+    resolve_file_url,
+    with_lock,
+)
 
 
 class MetatreeFactory:
@@ -50,6 +89,18 @@ class Metatree:
         keys: tuple = None,
         location: dict = None,
         locking_enabled: bool = True,
+        indexing_enabled: bool = False,
+        manifest_enabled: bool = False,
+        content_addressed: bool = False,
+        children_page_size: int = None,
+        change_feed: bool = False,
+        generation_marker: bool = False,
+        cache_size: int = 128,
+        lock_lease: float = 60.0,
+        lock_timeout: float = 20.0,
+        artifact_cache: ArtifactCache = None,
+        mode: str = None,
+        replica_interval: float = 30.0,
         **kwargs,
     ):
         _parsed_url = urlparse(root)
@@ -59,23 +110,69 @@ class Metatree:
         self._keys = keys
         self._location = location or {}
         self._locking_enabled = locking_enabled
+        self._indexing_enabled = indexing_enabled
+        self._manifest_enabled = manifest_enabled or content_addressed
+        self._content_addressed = content_addressed
+        self._children_page_size = children_page_size
+        self._change_feed = change_feed
+        self._generation_marker = generation_marker
+        self._change_log = None
+        self._cache = MetadataCache(cache_size)
+        self._lock_lease = lock_lease
+        self._lock_timeout = lock_timeout
+        self._leases = []
+        self._local = local()
+        self._artifact_cache = (
+            ArtifactCache(artifact_cache)
+            if isinstance(artifact_cache, (str, Path))
+            else artifact_cache
+        )
+        if mode not in (None, "readonly-replica"):
+            raise Exception(f"Invalid mode: {mode}")
+        self._mode = mode
+        self._replica = None
         self._kwargs = kwargs
         self._io_handler.kwargs = kwargs
         if not kwargs.get("fs", None) is None:
             self._fs = kwargs.get("fs")
         else:
-            self._fs = fsspec.filesystem(_parsed_url.scheme, **kwargs)
+            self._fs = kwargs.get("registry", registry).get(
+                _parsed_url.scheme, **kwargs
+            )
+        if mode == "readonly-replica" and not self._io_handler.exists(
+            f"{self.root}/.metatree", fs=self._fs
+        ):
+            raise Exception(f"Path ({self.root}) is not a metatree.")
         if not kwargs.get("skip_init", False):
             self.init()
+        if mode == "readonly-replica":
+            self._replica = Replica(self, interval=replica_interval)
+
+    def close(self):
+        if self._replica is not None:
+            self._replica.stop()
+
+    def _check_writable(self):
+        if self._replica is not None:
+            raise Exception("Metatree is a read-only replica.")
 
     def init(self):
         if self._io_handler.exists(f"{self.root}/.metatree", fs=self._fs):
             self._keys = self.config.get("keys")
             self._locking_enabled = self.config.get("locking_enabled")
+            self._indexing_enabled = self.config.get("indexing_enabled", False)
+            self._manifest_enabled = self.config.get("manifest_enabled", False)
+            self._content_addressed = self.config.get("content_addressed", False)
+            self._children_page_size = self.config.get("children_page_size")
+            self._change_feed = self.config.get("change_feed", False)
+            self._generation_marker = self.config.get("generation_marker", False)
+            self._open_change_log()
             if not self.config.get("keys") == self._keys:
                 logging.warning(
                     "Keys are not equal to config. Provided keys will be ignored."
                 )
+            if self._mode is None:
+                self.recover()
         elif not self._exists():
             self._io_handler.mkdir(self.location, fs=self._fs)
             self._io_handler.touch(
@@ -83,10 +180,27 @@ class Metatree:
                 fs=self._fs,
             )
             self._io_handler.touch(f"{self.root}/.metatree", fs=self._fs)
-            self.config = dict(keys=self._keys, locking_enabled=self._locking_enabled)
+            self.config = dict(
+                keys=self._keys,
+                locking_enabled=self._locking_enabled,
+                indexing_enabled=self._indexing_enabled,
+                manifest_enabled=self._manifest_enabled,
+                content_addressed=self._content_addressed,
+                children_page_size=self._children_page_size,
+                change_feed=self._change_feed,
+                generation_marker=self._generation_marker,
+            )
+            self._open_change_log()
         else:
             raise Exception(f"Path ({self.location}) already in use.")
 
+    def _open_change_log(self):
+        if self._change_feed:
+            self._change_log = ChangeLog(
+                self.root, self._io_handler, self._fs, lease=self._lock_lease
+            )
+            self._io_handler.mkdir(self._change_log.location, fs=self._fs)
+
     @property
     def root(self):
         return self._root
@@ -94,7 +208,15 @@ class Metatree:
     def set_location_to_root(self):
         self._location = {}
 
+    def refresh(self):
+        self._cache.refresh()
+
+    def invalidate(self):
+        self._cache.invalidate()
+
+    @instrumented("find")
     def find(self, location):
+        self.refresh()
         self.set_location_to_root()
         found, _ = self._find(location)
         return found
@@ -113,19 +235,150 @@ class Metatree:
                 raise Exception(f"Invalid child: {child}")
         return child
 
-    def _create_child_location(self, next, child):
-        if not next._exists():
-            self._io_handler.mkdir(next.location, fs=self._fs)
-            next.metadata = {}
-        self.metadata = (
-            dict(children=[child])
-            if self.metadata is None
-            else dict(
-                {k: v for k, v in self.metadata.items() if not k == "children"},
-                children=list(set([child, *self.metadata.get("children", [])])),
+    def _create_child_location(self, location, metadata, child_location, child):
+        if not self._io_handler.exists(child_location, fs=self._fs):
+            self._io_handler.mkdir(child_location, fs=self._fs)
+            self._create_metadata(child_location)
+        if self._has_child(location, metadata, child):
+            return metadata
+        return self._add_children(location, [child])
+
+    def _create_metadata(self, location):
+        metadata = dict(_created=time())
+        if self._transaction is not None:
+            return self._write_metadata(location, metadata)
+        filepath = f"{location}/{self._io_handler._metadata_filename}"
+        # Another writer may have created and filled the node since the exists
+        # check; only an exclusive create keeps its metadata.
+        try:
+            self._io_handler.create(
+                filepath, self._io_handler.dumps(metadata), fs=self._fs
+            )
+        except FileExistsError:
+            pass
+        self._cache.invalidate(filepath)
+
+    def _page(self, location, page, fresh=False):
+        return self._to_dict(
+            location, f"{location}/{page_filename(page.get('page'))}", fresh=fresh
+        ).get("children", [])
+
+    def _has_child(self, location, metadata, child, fresh=False):
+        pages = metadata.get("children_pages")
+        if pages is None:
+            return contains(metadata.get("children", []), child)
+        return contains(
+            self._page(location, pages[page_index(pages, child)], fresh=fresh), child
+        )
+
+    def _iter_children(self, location, metadata, start_after=None):
+        pages = metadata.get("children_pages")
+        if pages is None:
+            pages, children = [None], sorted(metadata.get("children", []))
+        for page in page_slice(pages, start_after):
+            if page is not None:
+                children = self._page(location, page)
+            if start_after is not None:
+                children = children[bisect_right(children, start_after) :]
+            yield from children
+
+    @instrumented("list_children")
+    def list_children(self, start_after=None, limit=None):
+        return list(
+            islice(
+                self._iter_children(self.location, self.metadata, start_after), limit
             )
         )
 
+    def _write_pages(self, location, pages, i, children):
+        page_size = self._children_page_size or len(children)
+        chunks = split(children, page_size) if len(children) > page_size else [children]
+        replacement = [dict(pages[i], first=chunks[0][0], count=len(chunks[0]))]
+        replacement.extend(new_page(chunk) for chunk in chunks[1:])
+        for page, chunk in zip(replacement, chunks):
+            self._commit_metadata(
+                location,
+                dict(children=chunk),
+                filepath=f"{location}/{page_filename(page.get('page'))}",
+            )
+        pages[i : i + 1] = replacement
+
+    @with_lock
+    def _remove_children(self, location, children):
+        """Return the page files left empty, which the caller deletes."""
+        metadata = self._to_dict(location, fresh=True)
+        removed = set(children)
+        emptied = []
+        pages = metadata.get("children_pages")
+        if pages is None:
+            remaining = [c for c in metadata.get("children", []) if c not in removed]
+            metadata = {k: v for k, v in metadata.items() if not k == "children"}
+            if remaining:
+                metadata["children"] = remaining
+        else:
+            updated = []
+            for page in pages:
+                names = self._page(location, page, fresh=True)
+                remaining = [c for c in names if c not in removed]
+                if len(remaining) == len(names):
+                    updated.append(page)
+                elif not remaining:
+                    emptied.append(f"{location}/{page_filename(page.get('page'))}")
+                else:
+                    page = dict(page, first=remaining[0], count=len(remaining))
+                    self._commit_metadata(
+                        location,
+                        dict(children=remaining),
+                        filepath=f"{location}/{page_filename(page.get('page'))}",
+                    )
+                    updated.append(page)
+            metadata = {k: v for k, v in metadata.items() if not k == "children_pages"}
+            if updated:
+                metadata["children_pages"] = updated
+        self._commit_metadata(location, metadata)
+        for filepath in emptied:
+            self._cache.invalidate(filepath)
+        return emptied
+
+    @with_lock
+    def _add_children(self, location, children, created=False):
+        metadata = self._to_dict(location, fresh=True)
+        missing = [
+            child
+            for child in children
+            if not self._has_child(location, metadata, child, fresh=True)
+        ]
+        if not missing and not created:
+            return metadata
+        rest = {
+            k: v for k, v in metadata.items() if not k in ("children", "children_pages")
+        }
+        if created:
+            rest.setdefault("_created", time())
+        pages = metadata.get("children_pages")
+        if pages is None:
+            children = merge(metadata.get("children", []), missing)
+            if self._children_page_size and len(children) > self._children_page_size:
+                pages = [
+                    dict(first=children[0], count=0, page=new_page(children)["page"])
+                ]
+                self._write_pages(location, pages, 0, children)
+                metadata = dict(rest, children_pages=pages)
+            else:
+                metadata = dict(rest, **(dict(children=children) if children else {}))
+        else:
+            pages = [dict(page) for page in pages]
+            groups = {}
+            for child in missing:
+                groups.setdefault(page_index(pages, child), []).append(child)
+            # Splitting a page shifts the ones after it, so go right to left.
+            for i in sorted(groups, reverse=True):
+                children = merge(self._page(location, pages[i], fresh=True), groups[i])
+                self._write_pages(location, pages, i, children)
+            metadata = dict(rest, children_pages=pages)
+        self._commit_metadata(location, metadata)
+        return metadata
+
     @classmethod
     def parse_string_location(cls, location, keys):
         splited = location.strip("/").split("/")
@@ -138,66 +391,480 @@ class Metatree:
             for k, p in enumerate(splited)
         }
 
+    def _node(self, location: dict):
+        node = object.__new__(self.__class__)
+        node.__dict__.update(self.__dict__)
+        node._location = location
+        node._locked = None
+        node._leases = []
+        return node
+
     def _find(self, location: dict, create_location_if_not_exists: bool = False):
+        if create_location_if_not_exists:
+            self._check_writable()
         if isinstance(location, str):
             location: dict = self.__class__.parse_string_location(location, self._keys)
+        resolved = dict(self._location)
+        metadata = self._to_dict(self.location)
         for key in self._keys:
             child = location.get(key, None)
-            if self._location.get(key, None) is None and child is not None:
-                child = self.__class__.parse_child(
-                    child,
-                    self.metadata,
+            if resolved.get(key, None) is not None or child is None:
+                continue
+            child = self.__class__.parse_child(child, metadata)
+            parent_location = self._location_of(resolved)
+            resolved = {key: child, **resolved}
+            child_location = self._location_of(resolved)
+            if create_location_if_not_exists:
+                self._create_child_location(
+                    parent_location, metadata, child_location, child
                 )
-                kwargs = dict(
-                    self._kwargs,
-                    location={key: child, **self._location},
-                    skip_init=True,
-                    io_handler=self._io_handler,
-                    fs=self._fs,
-                    **self.config,
-                )
-                next = self.__class__(
-                    self._root,
-                    **kwargs,
-                )
-                if create_location_if_not_exists:
-                    self._create_child_location(next, child)
-                if not next._exists():
-                    raise Exception(f"Path ({next.location}) does not exist.")
-                if not child in self.metadata.get("children", []):
-                    raise Exception(f"Child ({child}) not found in metadata.")
-                tree, self._location = next._find(
-                    location,
-                    create_location_if_not_exists=create_location_if_not_exists,
-                )
-                return tree, self._location
-        return self, self._location
+            elif not self._has_child(parent_location, metadata, child):
+                if not self._io_handler.exists(child_location, fs=self._fs):
+                    raise Exception(f"Path ({child_location}) does not exist.")
+                raise Exception(f"Child ({child}) not found in metadata.")
+            metadata = self._to_dict(child_location)
+        if resolved == self._location:
+            return self, self._location
+        # Membership was checked at every level, so the deepest directory
+        # existing implies the whole path exists.
+        if (
+            not create_location_if_not_exists
+            and self._replica is None
+            and not self._io_handler.exists(child_location, fs=self._fs)
+        ):
+            raise Exception(f"Path ({child_location}) does not exist.")
+        self._location = resolved
+        return self._node(resolved), self._location
 
+    @instrumented("put")
     def put(self, location, filepath=None, force=False, recursive=False):
+        self.refresh()
         self.set_location_to_root()
         self._find(location, create_location_if_not_exists=True)
         if not Path(filepath).exists():
             raise Exception(f"File ({filepath}) does not exist.")
-        if self._exists():
-            if self._io_handler.exists(
-                f"{self.location}/{Path(filepath).name}", fs=self._fs
-            ):
-                raise Exception(f"File ({filepath}) already exists.")
-            return self._io_handler.copy(
+        if self._has_file(self.location, Path(filepath).name):
+            raise Exception(f"File ({filepath}) already exists.")
+        if not self._manifest_enabled:
+            copied = self._io_handler.copy(
                 self.location,
                 filepath,
                 fs=self._fs,
                 recursive=recursive,
             )
+            if copied:
+                self._record_change(self.location, "put", files=[Path(filepath).name])
+            return copied
+        entry = self._upload(self.location, filepath, recursive=recursive)
+        if entry is None:
+            return False
+        self._record_files(self.location, {Path(filepath).name: entry})
+        self._record_change(self.location, "put", files=[Path(filepath).name])
+        return True
 
+    @instrumented("put_stream")
+    def put_stream(self, location, name, source, block_size=None):
+        """
+        Store `source` (bytes, a file-like object or an iterable of chunks)
+        as file `name` of node `location` without a local copy.
+        """
+        if (
+            not name
+            or "/" in name
+            or name.startswith(
+                (
+                    self._io_handler._metadata_filename,
+                    *self._io_handler._reserved_prefixes,
+                )
+            )
+        ):
+            raise Exception(f"Invalid file name ({name}).")
+        self.refresh()
+        self.set_location_to_root()
+        self._find(location, create_location_if_not_exists=True)
+        if self._has_file(self.location, name):
+            raise Exception(f"File ({name}) already exists.")
+        if self._content_addressed:
+            entry = self._io_handler.upload_blob_stream(
+                self._location_of({}), source, fs=self._fs, block_size=block_size
+            )
+        else:
+            entry = self._io_handler.upload_stream(
+                self.location, name, source, fs=self._fs, block_size=block_size
+            )
+        if self._manifest_enabled:
+            self._record_files(self.location, {name: entry})
+        self._record_change(self.location, "put", files=[name])
+        return True
+
+    def _upload(self, location, filepath, recursive=False):
+        if self._content_addressed and Path(filepath).is_file():
+            return self._io_handler.upload_blob(
+                self._location_of({}), filepath, fs=self._fs
+            )
+        return self._io_handler.upload(
+            location, filepath, fs=self._fs, recursive=recursive
+        )
+
+    def _resolve_file(self, location, name):
+        """Return the stored location of file `name` of node `location`."""
+        entry = (self._files(location) or {}).get(name) or {}
+        if entry.get("blob") is not None:
+            return f"{self._location_of({})}/{entry.get('blob')}", entry
+        return f"{location}/{name}", entry
+
+    def _files(self, location):
+        if not self._manifest_enabled:
+            return None
+        return self._to_dict(location).get("files")
+
+    def _has_file(self, location, name):
+        files = self._files(location)
+        if files is None:
+            return self._io_handler.exists(f"{location}/{name}", fs=self._fs)
+        return name in files
+
+    @with_lock
+    def _record_files(self, location, entries):
+        metadata = self._to_dict(location, fresh=True)
+        files = metadata.get("files")
+        if files is None:
+            files = {
+                name: entry
+                for name, entry in self._io_handler.scan(location, fs=self._fs).items()
+                if not self._has_child(location, metadata, name)
+            }
+        self._commit_metadata(location, dict(metadata, files=dict(files, **entries)))
+
+    def _plan_location(self, location, children, created):
+        if isinstance(location, str):
+            location = self.__class__.parse_string_location(location, self._keys)
+        resolved = {}
+        metadata = self._to_dict(self._location_of(resolved))
+        for key in self._keys:
+            child = location.get(key, None)
+            if child is None:
+                continue
+            child = self.__class__.parse_child(child, metadata)
+            parent_location = self._location_of(resolved)
+            resolved = {key: child, **resolved}
+            child_location = self._location_of(resolved)
+            if child_location in created:
+                metadata = {}
+            elif not self._has_child(parent_location, metadata, child):
+                children.setdefault(parent_location, set()).add(child)
+                children.setdefault(child_location, set())
+                created[child_location] = len(resolved)
+                metadata = {}
+            else:
+                metadata = self._to_dict(child_location)
+        return self._location_of(resolved)
+
+    @instrumented("put_many")
+    def put_many(self, items, max_workers: int = 8, recursive=False):
+        self._check_writable()
+        self.refresh()
+        self.set_location_to_root()
+        items = [tuple(item) for item in items]
+        results = [None] * len(items)
+        targets, children, created = {}, {}, {}
+        for i, (location, filepath) in enumerate(items):
+            try:
+                if not Path(filepath).exists():
+                    raise Exception(f"File ({filepath}) does not exist.")
+                targets[i] = self._plan_location(location, children, created)
+            except Exception as e:
+                results[i] = e
+        # Deepest nodes first, so a child is complete before its parent lists it.
+        for location in sorted(children, key=lambda l: -created.get(l, 0)):
+            if location in created:
+                self._io_handler.mkdir(location, fs=self._fs)
+            self._add_children(
+                location, sorted(children[location]), created=location in created
+            )
+        claimed = {}
+        for location in set(targets.values()):
+            files = self._files(location)
+            claimed[location] = set(
+                self._io_handler.iterdir(location, fs=self._fs)
+                if files is None
+                else [*files, *self._iter_children(location, self._to_dict(location))]
+            )
+
+        def upload(location, filepath):
+            if not self._manifest_enabled:
+                return self._io_handler.copy(
+                    location, filepath, fs=self._fs, recursive=recursive
+                )
+            return self._upload(location, filepath, recursive=recursive)
+
+        futures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for i, location in targets.items():
+                filepath = items[i][1]
+                if Path(filepath).name in claimed[location]:
+                    results[i] = Exception(f"File ({filepath}) already exists.")
+                    continue
+                claimed[location].add(Path(filepath).name)
+                futures[i] = executor.submit(upload, location, filepath)
+        entries = {}
+        for i, future in futures.items():
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                results[i] = e
+                continue
+            if self._manifest_enabled:
+                if results[i] is not None:
+                    entries.setdefault(targets[i], {})[Path(items[i][1]).name] = (
+                        results[i]
+                    )
+                results[i] = results[i] is not None
+        for location, files in entries.items():
+            self._record_files(location, files)
+        put = {}
+        for i, location in targets.items():
+            if results[i] is True:
+                put.setdefault(location, []).append(Path(items[i][1]).name)
+        for location, files in put.items():
+            self._record_change(location, "put", files=sorted(files))
+        return results
+
+    def export_snapshot(self, path, include_files=False):
+        """
+        Write every metadata document of the tree, and with `include_files`
+        its artifacts, to the archive `path`. Writers are not blocked, so
+        export a tree that is not being written to.
+        """
+        root_location = self._location_of({})
+        handler, fs = self._io_handler, self._fs
+        blobs = set()
+        with fsspec.open(path, "wb") as file:
+            writer = SnapshotWriter(file)
+            for name in (".metatree", ".index"):
+                filepath = f"{self.root}/{name}"
+                if handler.exists(filepath, fs=fs):
+                    document = handler.to_dict(self.root, filepath=filepath, fs=fs)
+                    writer.add(name, "document", packb(document))
+            for node, metadata in self._node({})._walk():
+                location = f"{root_location}/{node}".rstrip("/")
+                writer.add(node, "metadata", packb(metadata))
+                for page in metadata.get("children_pages", []):
+                    name = page_filename(page.get("page"))
+                    document = handler.to_dict(
+                        location, filepath=f"{location}/{name}", fs=fs
+                    )
+                    writer.add(join(node, name), "document", packb(document))
+                if not include_files:
+                    continue
+                files = metadata.get("files")
+                if files is None:
+                    files = {
+                        name: {}
+                        for name in handler.iterdir(location, fs=fs)
+                        if not name.startswith(
+                            (handler._metadata_filename, *handler._reserved_prefixes)
+                        )
+                        and not self._has_child(location, metadata, name)
+                    }
+                for name, entry in files.items():
+                    if entry.get("blob") is not None:
+                        if entry.get("blob") in blobs:
+                            continue
+                        blobs.add(entry.get("blob"))
+                        remote, relative = (
+                            f"{root_location}/{entry.get('blob')}",
+                            entry.get("blob"),
+                        )
+                    else:
+                        remote, relative = f"{location}/{name}", join(node, name)
+                    prefix = fs._strip_protocol(remote).rstrip("/")
+                    for filepath in fs.find(remote):
+                        with fs.open(filepath, "rb") as source:
+                            writer.add_stream(
+                                f"{relative}{filepath[len(prefix):]}", "file", source
+                            )
+            writer.close()
+        return path
+
+    @classmethod
+    def load_snapshot(cls, snapshot, root, max_workers=8, **kwargs):
+        """Create the tree `root` from an archive written by `export_snapshot`."""
+        # An archive opened here is closed again; a Snapshot passed in is not.
+        opened = None if isinstance(snapshot, Snapshot) else Snapshot(snapshot)
+        with opened or nullcontext():
+            snapshot = opened or snapshot
+            keys = tuple(snapshot.document(".metatree").get("keys"))
+            tree = cls(root, keys, skip_init=True, **kwargs)
+            handler, fs = tree._io_handler, tree._fs
+            if handler.exists(f"{tree.root}/.metatree", fs=fs):
+                raise Exception(f"Path ({tree.root}) already in use.")
+            root_location = tree._location_of({})
+
+            def load(path):
+                kind = snapshot.kind(path)
+                filepath = f"{root_location}/{path}".rstrip("/")
+                if kind == "metadata":
+                    handler.mkdir(filepath, fs=fs)
+                    handler.from_dict(filepath, snapshot.document(path), fs=fs)
+                    return
+                handler.mkdir(filepath.rsplit("/", 1)[0], fs=fs)
+                if kind == "document":
+                    handler.from_dict(
+                        root_location, snapshot.document(path), filepath=filepath, fs=fs
+                    )
+                else:
+                    with fs.open(filepath, "wb") as file:
+                        file.write(snapshot.read(path))
+
+            # The tree only opens once .metatree is written, so it goes last.
+            paths = [path for path in snapshot if path not in (".metatree", ".index")]
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                list(executor.map(load, paths))
+            for name in (".index", ".metatree"):
+                if name in snapshot:
+                    handler.from_dict(
+                        tree.root,
+                        snapshot.document(name),
+                        filepath=f"{tree.root}/{name}",
+                        fs=fs,
+                    )
+        return cls(root, **kwargs)
+
+    @instrumented("gc")
+    def gc(self, key, *policies, dry_run=False):
+        """
+        Delete the `key` nodes that no retention policy keeps, together with
+        their subtrees and artifacts, and return their paths. Blobs only
+        referenced by deleted nodes are removed too, so do not upload into a
+        content-addressed tree while it is collected.
+        """
+        self._check_writable()
+        if not policies:
+            raise Exception("At least one retention policy is required.")
+        if key not in self._keys:
+            raise Exception(f"Unknown key: {key}")
+        depth = self._keys.index(key) + 1
+        # A single scan; deeper levels are only needed for blobs and the index.
+        full = self._content_addressed or self._indexing_enabled
+        nodes = dict(self._node({})._walk(depth=None if full else depth))
+        deleted = plan(nodes, depth, policies)
+        if dry_run or not deleted:
+            return deleted
+        deleted_paths = set(deleted)
+        removed = [
+            path
+            for path in nodes
+            if path.count("/") + 1 >= depth
+            and "/".join(path.split("/")[:depth]) in deleted_paths
+        ]
+        root_location = self._location_of({})
+        by_parent = {}
+        for path in deleted:
+            parent, _, name = path.rpartition("/")
+            by_parent.setdefault(parent, []).append(name)
+        # Parents stop listing the nodes before anything is removed, so
+        # readers never resolve a half-deleted node.
+        emptied = []
+        for parent, names in by_parent.items():
+            emptied += self._remove_children(
+                f"{root_location}/{parent}".rstrip("/"), names
+            )
+        self._fs.rm(
+            [f"{root_location}/{path}" for path in deleted] + emptied, recursive=True
+        )
+        if self._content_addressed:
+            removed_paths = set(removed)
+            referenced = {
+                entry.get("blob")
+                for path, metadata in nodes.items()
+                if path not in removed_paths
+                for entry in metadata.get("files", {}).values()
+            }
+            orphaned = {
+                entry.get("blob")
+                for path in removed
+                for entry in nodes[path].get("files", {}).values()
+                if entry.get("blob") is not None and entry.get("blob") not in referenced
+            }
+            if orphaned:
+                self._fs.rm([f"{root_location}/{blob}" for blob in sorted(orphaned)])
+        if self._indexing_enabled:
+            self._update_index({path: {} for path in removed})
+        for path in deleted:
+            self._record_change(f"{root_location}/{path}", "delete")
+        self._cache.invalidate()
+        return deleted
+
+    def walk(self, depth: int = None, filter=None, max_workers=8, batch_size=256):
+        for path, metadata in self._walk(depth, filter, max_workers, batch_size):
+            yield path, public_metadata(metadata)
+
+    def _walk(self, depth=None, filter=None, max_workers=8, batch_size=256):
+        limit = len(self._keys)
+        if depth is not None:
+            limit = min(limit, len(self._location) + depth)
+        pending = [dict(self._location)]
+        while pending:
+            batch = pending[-batch_size:][::-1]
+            del pending[-batch_size:]
+            # Sibling metadata files are fetched together, but only one batch
+            # is held at a time so memory stays flat on wide trees.
+            metadata = self._io_handler.to_dicts(
+                [self._location_of(resolved) for resolved in batch],
+                fs=self._fs,
+                max_workers=max_workers,
+            )
+            for resolved, node_metadata in zip(batch, metadata):
+                path = self._relative(self._location_of(resolved))
+                if filter is None or filter(path, node_metadata):
+                    yield path, node_metadata
+                if len(resolved) < limit:
+                    key = self._keys[len(resolved)]
+                    pending.extend(
+                        {**resolved, key: child}
+                        for child in reversed(
+                            list(
+                                self._iter_children(
+                                    self._location_of(resolved), node_metadata
+                                )
+                            )
+                        )
+                    )
+
+    @instrumented("list")
     def list(self):
+        files = self._files(self.location)
+        if files is not None:
+            return [*self._iter_children(self.location, self.metadata), *files]
         return [
             i
             for i in self._io_handler.iterdir(self.location, fs=self._fs)
-            if not i.startswith(self._io_handler._metadata_filename)
+            if not i.startswith(
+                (
+                    self._io_handler._metadata_filename,
+                    *self._io_handler._reserved_prefixes,
+                )
+            )
         ]
 
-    def get(self, location: str, outfile: str = None, recursive=False):
+    @instrumented("get")
+    def get(
+        self,
+        location: str,
+        outfile: str = None,
+        recursive=False,
+        chunk_size: int = None,
+        block_size: int = None,
+        max_workers: int = 8,
+        mode: str = None,
+    ):
+        if mode not in (None, "path", "mmap"):
+            raise Exception(f"Invalid mode: {mode}")
+        if mode is not None and self._artifact_cache is None and not self._is_local:
+            raise Exception(
+                f"mode={mode} requires a local backend or an artifact cache."
+            )
         if outfile is not None:
             if Path(outfile).exists():
                 raise Exception(f"Path '{outfile}' already exists.")
@@ -219,85 +886,471 @@ class Metatree:
             found.metadata,
         )
         if child in found.list():
+            remote, entry = found._resolve_file(found.location, child)
+            if mode is not None and self._is_local:
+                # Local artifacts are mapped in place instead of copied.
+                path = self._fs._strip_protocol(remote)
+                return path if mode == "path" else map_file(path)
+            if self._artifact_cache is not None and not recursive:
+                path = self._cached_file(
+                    found.location, child, remote, entry, block_size, max_workers
+                )
+                if mode == "path":
+                    return path
+                if mode == "mmap":
+                    return map_file(path)
+                if outfile is not None:
+                    shutil.copyfile(path, outfile)
+                return ArtifactCache.read(path, chunk_size=chunk_size)
             if outfile is not None:
-                found._fs.download(
-                    f"{found.location}/{child}", outfile, recursive=recursive
+                self._io_handler.download(
+                    remote,
+                    outfile,
+                    fs=self._fs,
+                    recursive=recursive,
+                    block_size=block_size,
+                    max_workers=max_workers,
                 )
                 if not Path(outfile).exists():
                     raise Exception(f"Download failed.")
-            return self._io_handler.read(f"{found.location}/{child}", fs=self._fs)
+                if entry.get("blob") is not None and not file_checksum(
+                    outfile
+                ) == entry.get("checksum"):
+                    raise Exception(f"Checksum mismatch ({outfile}).")
+            return self._io_handler.read(remote, chunk_size=chunk_size, fs=self._fs)
+
+    @property
+    def _is_local(self):
+        return isinstance(self._fs, LocalFileSystem)
+
+    def _cached_file(self, location, name, remote, entry, block_size, max_workers):
+        checksum = entry.get("checksum")
+        version = checksum or self._io_handler.token(remote, fs=self._fs)
+
+        def fetch(tmpfile):
+            self._io_handler.download(
+                remote,
+                tmpfile,
+                fs=self._fs,
+                block_size=block_size,
+                max_workers=max_workers,
+            )
+            if checksum is not None and not file_checksum(tmpfile) == checksum:
+                raise Exception(f"Checksum mismatch ({remote}).")
 
-    def update(self, **kwargs):
-        if "children" in kwargs:
+        return self._artifact_cache.fill(
+            ArtifactCache.key(location, name, version), fetch
+        )
+
+    @instrumented("update")
+    def update(self, if_version: int = None, **kwargs):
+        if "children" in kwargs or "children_pages" in kwargs:
             raise Exception("You cannot update children.")
-        self.metadata = dict(self.metadata, **{k: str(v) for k, v in kwargs.items()})
+        if "files" in kwargs:
+            raise Exception("You cannot update files.")
+        for key in hidden_keys:
+            if key in kwargs:
+                raise Exception(f"You cannot update {key}.")
+        kwargs = {k: str(v) for k, v in kwargs.items()}
+        if if_version is None:
+            self._write_metadata(self.location, kwargs)
+            return self.version
+        return self._compare_and_swap(
+            self.location, if_version, lambda metadata: dict(metadata, **kwargs)
+        )
 
     def _exists(self):
         return self._io_handler.exists(self.location, fs=self._fs)
 
-    @property
-    def location(self):
+    def _location_of(self, location: dict):
         ordered_values = []
         for k in self._keys:
-            if k in self._location:
-                ordered_values.append(self._location.get(k))
+            if k in location:
+                ordered_values.append(location.get(k))
         return f"{self.root}/{'/'.join(ordered_values)}".rstrip("/").replace(
             "webhdfs://", ""
         )
 
+    @property
+    def location(self):
+        return self._location_of(self._location)
+
+    def _to_dict(self, location, filepath=None, fresh=False):
+        if filepath is None and self._replica is not None:
+            return self._replica.get(self._relative(location))
+        if filepath is None:
+            filepath = f"{location}/{self._io_handler._metadata_filename}"
+        transaction = self._transaction
+        if transaction is not None and filepath in transaction.writes:
+            return transaction.lookup(filepath)
+        if fresh:
+            self._cache.invalidate(filepath)
+        return self._cache.get(
+            filepath,
+            lambda: self._io_handler.to_dict(location, filepath=filepath, fs=self._fs),
+            lambda: self._io_handler.token(filepath, fs=self._fs),
+        )
+
+    def _from_dict(self, location, metadata, filepath=None):
+        if filepath is None:
+            filepath = f"{location}/{self._io_handler._metadata_filename}"
+        self._io_handler.from_dict(location, metadata, filepath=filepath, fs=self._fs)
+        self._cache.put(filepath, metadata)
+
     @property
     def metadata(self):
-        return self._io_handler.to_dict(self.location, fs=self._fs)
+        return public_metadata(self._to_dict(self.location))
 
     @metadata.setter
-    @with_lock
     def metadata(self, metadata):
-        self._io_handler.from_dict(self.location, metadata, fs=self._fs)
+        base = self.metadata
+        protected = ("children", "children_pages", "files", *hidden_keys)
+        changes = {
+            k: v
+            for k, v in metadata.items()
+            if k not in protected and not (k in base and base[k] == v)
+        }
+        removed = [k for k in base if k not in metadata and k not in protected]
+        self._write_metadata(self.location, changes, removed)
         self._metadata = metadata
 
+    @property
+    def version(self):
+        return self._to_dict(self.location).get("_version", 0)
+
+    @with_lock
+    def _write_metadata(self, location, changes, removed=()):
+        # The cached document may be older than the stored one, so only the
+        # caller's changes are applied to a fresh read made under the lock.
+        current = self._to_dict(location, fresh=True)
+        metadata = {k: v for k, v in current.items() if k not in removed}
+        metadata.update(changes)
+        self._commit_metadata(location, metadata)
+        self._record_change(
+            location,
+            "update",
+            dict(metadata, _version=metadata.get("_version", 0) + 1),
+        )
+
+    def _record_change(self, location, op, metadata=None, files=None):
+        if self._change_log is None:
+            if self._transaction is None and self._generation_marker:
+                self._bump_generation()
+            return
+        change = dict(op=op, path=self._relative(location), time=time())
+        if metadata is not None:
+            change.update(
+                version=metadata.get("_version"),
+                metadata={
+                    k: v
+                    for k, v in metadata.items()
+                    if k not in ("children", "children_pages", "files")
+                    and k not in hidden_keys
+                },
+            )
+        if files is not None:
+            change.update(files=files)
+        transaction = self._transaction
+        if transaction is not None:
+            transaction.changes.append(change)
+        else:
+            self._change_log.append(change)
+
+    def _bump_generation(self):
+        # Replicas of a tree without a change feed reload when this changes.
+        self._io_handler.from_dict(
+            self.root,
+            dict(generation=uuid.uuid4().hex),
+            filepath=f"{self.root}/.generation",
+            fs=self._fs,
+        )
+
+    def watch(self, prefix="", since: int = None, poll_interval=1.0, timeout=None):
+        """
+        Yield change records below `prefix`, oldest first, as writers append
+        them. `since` is the last sequence number already seen; None starts
+        at the end of the log. Stops after `timeout` seconds without changes.
+        """
+        if self._change_log is None:
+            raise Exception("Change feed is not enabled.")
+        for change in self._change_log.tail(since, poll_interval, timeout):
+            if matches(change, prefix):
+                yield change
+
+    def compact_changes(self, keep: int = 10000):
+        """Remove all but the last `keep` change records."""
+        if self._change_log is None:
+            raise Exception("Change feed is not enabled.")
+        self._check_writable()
+        return self._change_log.compact(keep)
+
+    def _compare_and_swap(self, location, version, update):
+        filepath = f"{location}/{self._io_handler._metadata_filename}"
+        conditional = self._io_handler._conditional_writes and self._transaction is None
+        # Other writers do a locked read and a blind write, so the node lock
+        # is held on every backend. The conditional put additionally catches
+        # writers that do not lock; its ETag is taken before the read, so a
+        # write in between fails it instead of being overwritten.
+        lock = self.lock(location)
+        try:
+            etag = self._io_handler.etag(filepath, fs=self._fs) if conditional else None
+            metadata = self._to_dict(location, fresh=True)
+            if not metadata.get("_version", 0) == version:
+                raise VersionConflictError(
+                    f"Metadata ({location}) is at version "
+                    f"{metadata.get('_version', 0)}, not {version}."
+                )
+            metadata = update(metadata)
+            if not conditional:
+                self._commit_metadata(location, metadata)
+                self._record_change(
+                    location, "update", dict(metadata, _version=version + 1)
+                )
+                return version + 1
+            metadata = dict(metadata, _version=version + 1)
+            try:
+                self._io_handler.write_if_match(
+                    filepath, self._io_handler.dumps(metadata), etag, fs=self._fs
+                )
+            finally:
+                self._cache.invalidate(filepath)
+            if self._indexing_enabled:
+                self._update_index({self._relative(location): metadata})
+            self._record_change(location, "update", metadata)
+            return metadata["_version"]
+        finally:
+            self.unlock(lock)
+
+    def _commit_metadata(self, location, metadata, filepath=None):
+        self._check_writable()
+        base = None
+        if filepath is None:
+            base = metadata.get("_version", 0)
+            metadata = dict(metadata, _version=base + 1)
+        transaction = self._transaction
+        if transaction is not None:
+            transaction.record(
+                location,
+                filepath or f"{location}/{self._io_handler._metadata_filename}",
+                metadata,
+                base=base,
+            )
+            return
+        self._from_dict(location, metadata, filepath=filepath)
+        if self._indexing_enabled and filepath is None:
+            self._update_index({self._relative(location): metadata})
+
+    @property
+    def _transaction(self):
+        return getattr(self._local, "transaction", None)
+
+    @contextmanager
+    def transaction(self):
+        if self._transaction is not None:
+            yield self._transaction
+            return
+        transaction = self._local.transaction = Transaction()
+        try:
+            yield transaction
+        finally:
+            self._local.transaction = None
+        self._apply_transaction(transaction)
+
+    def _apply_transaction(self, transaction, location=None):
+        if not transaction:
+            return
+        journaled = location is not None
+        if location is None:
+            location = transaction.common_location(self._location_of({}))
+        journal = transaction.journal(self.root)
+        # Replays skip journals whose writer still holds the lock.
+        lock = self.lock(location, blocking=not journaled)
+        if lock is None:
+            return
+        try:
+            if not journaled:
+                self._check_bases(transaction)
+                self._create_journal(journal, transaction.dumps(location))
+            elif not self._io_handler.exists(journal, fs=self._fs):
+                return
+            nodes = {}
+            for filepath, (node, metadata) in transaction.writes.items():
+                self._from_dict(node, metadata, filepath=filepath)
+                if filepath == f"{node}/{self._io_handler._metadata_filename}":
+                    nodes[self._relative(node)] = metadata
+            if self._indexing_enabled:
+                self._update_index(nodes)
+            for change in transaction.changes:
+                self._change_log.append(change)
+            if self._change_log is None and self._generation_marker:
+                self._bump_generation()
+            self._io_handler.unlink(journal, fs=self._fs)
+        finally:
+            self.unlock(lock)
+
+    def _check_bases(self, transaction):
+        """
+        Fail the commit when a document the transaction writes was changed by
+        another writer after the transaction read it.
+        """
+        for filepath, base in transaction.bases.items():
+            location, _ = transaction.writes[filepath]
+            stored = self._io_handler.to_dict(location, filepath=filepath, fs=self._fs)
+            if not stored.get("_version", 0) == base:
+                self._cache.invalidate(filepath)
+                raise VersionConflictError(
+                    f"Metadata ({location}) is at version "
+                    f"{stored.get('_version', 0)}, not {base}."
+                )
+
+    def _create_journal(self, journal, data):
+        try:
+            self._io_handler.create(journal, data, fs=self._fs)
+        except FileNotFoundError:
+            self._io_handler.mkdir(journal.rsplit("/", 1)[0], fs=self._fs)
+            self._io_handler.create(journal, data, fs=self._fs)
+
+    def recover(self):
+        location = f"{self.root}/{Transaction._journal_dirname}"
+        try:
+            names = self._io_handler.iterdir(location, fs=self._fs)
+        except FileNotFoundError:
+            return
+        for name in names:
+            journal = f"{location}/{name}"
+            try:
+                location, transaction = Transaction.loads(
+                    self._io_handler.cat(journal, fs=self._fs)
+                )
+            except FileNotFoundError:
+                continue
+            except ValueError:
+                # A torn journal was never applied. It may still be being
+                # written, so it is only discarded once older than a lease.
+                mtime = self._fs.info(journal).get("mtime")
+                if mtime is not None and float(mtime) + self._lock_lease < time():
+                    logging.warning(f"Discarding incomplete journal ({journal}).")
+                    self._io_handler.unlink(journal, fs=self._fs)
+                continue
+            logging.warning(f"Replaying journal ({journal}).")
+            self._apply_transaction(transaction, location=location)
+
+    def _relative(self, location):
+        return location[len(self._location_of({})) :].strip("/")
+
+    def _index_lock(self):
+        return LeaseLock(
+            f"{self.root}/.index.lock",
+            self._io_handler,
+            self._fs,
+            lease=self._lock_lease,
+            timeout=self._lock_timeout,
+        )
+
+    def _update_index(self, nodes, rebuild=False):
+        filepath = f"{self.root}/.index"
+        if not rebuild:
+            # Writers hold the lock of every node they index, so an entry
+            # that already matches cannot change before this write lands;
+            # most writes only touch children and skip the index lock.
+            _, attributes = load_index(self._to_dict(self.root, filepath, fresh=True))
+            if all(
+                is_indexed(attributes, path, metadata)
+                for path, metadata in nodes.items()
+            ):
+                return
+        lock = self._index_lock() if self.config.get("locking_enabled") else None
+        if lock is not None:
+            lock.acquire()
+        try:
+            postings, attributes = (
+                ({}, {})
+                if rebuild
+                else load_index(self._to_dict(self.root, filepath, fresh=True))
+            )
+            for path, metadata in nodes.items():
+                index_node(postings, attributes, path, metadata)
+            self._from_dict(
+                self.root, dump_index(postings, attributes), filepath=filepath
+            )
+        except Exception as e:
+            self._cache.invalidate(filepath)
+            raise e
+        finally:
+            if lock is not None:
+                lock.release()
+
+    @instrumented("reindex")
+    def reindex(self):
+        self.refresh()
+        nodes = dict(self._node({}).walk())
+        self._update_index(nodes, rebuild=True)
+        if not self._indexing_enabled:
+            self._indexing_enabled = True
+            self.config = dict(self.config, indexing_enabled=True)
+
+    @instrumented("query")
+    def query(self, **filters):
+        if not self._indexing_enabled:
+            raise Exception("Indexing is not enabled. Call reindex() first.")
+        self.refresh()
+        postings, _ = load_index(
+            self._to_dict(self.root, filepath=f"{self.root}/.index")
+        )
+        return query_index(postings, filters)
+
     @property
     def config(self):
         return {
             k: tuple(v) if k == "keys" else v
-            for k, v in self._io_handler.to_dict(
-                self.root,
-                filepath=f"{self.root}/.metatree",
-                fs=self._fs,
+            for k, v in self._to_dict(
+                self.root, filepath=f"{self.root}/.metatree"
             ).items()
         }
 
     @config.setter
     def config(self, config_dict):
-        self._io_handler.from_dict(
+        self._from_dict(
             self.location,
             {k: list(v) if k == "keys" else v for k, v in config_dict.items()},
             filepath=f"{self.root}/.metatree",
-            fs=self._fs,
         )
 
-    def lock(self):
-        if not self.config.get("locking_enabled"):
+    def _ancestors(self, location):
+        root = self._location_of({})
+        parts = location[len(root) :].strip("/").split("/") if location != root else []
+        return ["/".join([root, *parts[:i]]) for i in range(len(parts))]
+
+    def lock(self, location=None, blocking: bool = True):
+        self._check_writable()
+        if not self.config.get("locking_enabled") or self._transaction is not None:
             return True
-        attempts = 0
-        while self._locked is not True:
-            if attempts > 5:
-                raise Exception("max attempts reached.")
-            try:
-                if self._io_handler.exists(f"{self.root}/.lock", fs=self._fs):
-                    raise Exception("Locking failed.")
-                self._locked = True
-                return self._io_handler.touch(f"{self.root}/.lock", fs=self._fs)
-            except Exception as e:
-                logging.warning("Locking failed.")
-                attempts += 1
-                sleep(3)
-        raise Exception("lock failed.")
+        location = self.location if location is None else location
+        lock = NodeLock(
+            location,
+            self._ancestors(location),
+            self._io_handler,
+            self._fs,
+            lease=self._lock_lease,
+            timeout=self._lock_timeout,
+        )
+        if blocking:
+            lock.acquire()
+        elif not lock.try_acquire():
+            return None
+        self._leases.append(lock)
+        self._locked = True
+        return lock
 
-    def unlock(self):
-        if not self.config.get("locking_enabled"):
+    def unlock(self, lock=None):
+        if lock is True or not self._leases:
             return True
-        self._locked = None
-        return self._io_handler.unlink(f"{self.root}/.lock", fs=self._fs)
+        lock = self._leases[-1] if lock is None else lock
+        if lock in self._leases:
+            self._leases.remove(lock)
+        self._locked = True if self._leases else None
+        lock.release()
+        return True
 
 
 class LocalJsonMetaTree(Metatree):
@@ -328,6 +1381,20 @@ class WebHdfsJsonMetaTree(Metatree):
         super().__init__(root, keys, location, **kwargs)
 
 
+class MemoryJsonMetaTree(Metatree):
+    _io_handler = MemoryJsonHandler
+    _url_scheme = ["memory"]
+
+    def __init__(
+        self,
+        root,
+        keys: tuple = None,
+        location=None,
+        **kwargs,
+    ):
+        super().__init__(root, keys, location, **kwargs)
+
+
 class S3JsonMetaTree(Metatree):
     _io_handler = S3JsonHandler
     _url_scheme = ["s3"]
@@ -0,0 +1,55 @@
+"""
+Convert the metadata files of a tree from one IOHandler encoding to another.
+
+    python -m metatree.migrate /tmp/my-model-repository LocalJsonHandler LocalPackedHandler
+"""
+
+import argparse
+
+from . import io_handler
+from .children import page_filename
+from .metatree import Metatree
+
+
+def migrate(root, source, target, remove_source=False, **kwargs):
+    tree = Metatree(root, io_handler=source, **kwargs)
+    root_location = tree._location_of({})
+    migrated = 0
+    for path, metadata in tree._walk():
+        location = f"{root_location}/{path}".rstrip("/")
+        for page in metadata.get("children_pages", []):
+            filepath = f"{location}/{page_filename(page.get('page'))}"
+            document = source.to_dict(location, filepath=filepath, fs=tree._fs)
+            target.from_dict(location, document, filepath=filepath, fs=tree._fs)
+        target.from_dict(location, metadata, fs=tree._fs)
+        if remove_source and source._metadata_filename != target._metadata_filename:
+            source.unlink(f"{location}/{source._metadata_filename}", fs=tree._fs)
+        migrated += 1
+    # Tree-level documents go last, so the tree only opens with the target
+    # handler once every node has been converted.
+    for name in (".index", ".metatree"):
+        filepath = f"{tree.root}/{name}"
+        if source.exists(filepath, fs=tree._fs):
+            document = source.to_dict(tree.root, filepath=filepath, fs=tree._fs)
+            target.from_dict(tree.root, document, filepath=filepath, fs=tree._fs)
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root")
+    parser.add_argument("source", help="IOHandler class name, e.g. LocalJsonHandler")
+    parser.add_argument("target", help="IOHandler class name, e.g. LocalPackedHandler")
+    parser.add_argument("--remove-source", action="store_true")
+    args = parser.parse_args()
+    migrated = migrate(
+        args.root,
+        getattr(io_handler, args.source),
+        getattr(io_handler, args.target),
+        remove_source=args.remove_source,
+    )
+    print(f"Migrated {migrated} nodes.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Compact binary encoding of metadata documents.
+
+A document is the magic `MTP1` followed by one tagged value. Containers are
+length prefixed, so a document is decoded from a single buffer without any
+text parsing. Lists of strings, such as `children`, are stored as one
+NUL-separated block that is split in a single call.
+"""
+
+import struct
+
+MAGIC = b"MTP1"
+
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _LIST, _DICT, _STRINGS, _BIGINT = range(10)
+
+_u32 = struct.Struct("<I")
+_i64 = struct.Struct("<q")
+_f64 = struct.Struct("<d")
+
+
+def _pack_str(value, out):
+    data = value.encode()
+    out += _u32.pack(len(data))
+    out += data
+
+
+def _pack(value, out):
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        if -(1 << 63) <= value < (1 << 63):
+            out.append(_INT)
+            out += _i64.pack(value)
+        else:
+            out.append(_BIGINT)
+            _pack_str(str(value), out)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _f64.pack(value)
+    elif isinstance(value, str):
+        out.append(_STR)
+        _pack_str(value, out)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        out += _u32.pack(len(value))
+        for k, v in value.items():
+            _pack_str(str(k), out)
+            _pack(v, out)
+    elif isinstance(value, (list, tuple)):
+        if value and all(isinstance(v, str) and "\0" not in v for v in value):
+            data = "\0".join(value).encode()
+            out.append(_STRINGS)
+            out += _u32.pack(len(value))
+            out += _u32.pack(len(data))
+            out += data
+        else:
+            out.append(_LIST)
+            out += _u32.pack(len(value))
+            for v in value:
+                _pack(v, out)
+    else:
+        raise TypeError(f"Cannot pack {type(value).__name__}.")
+
+
+def _unpack_str(data, offset):
+    (size,) = _u32.unpack_from(data, offset)
+    offset += 4
+    return str(data[offset : offset + size], "utf-8"), offset + size
+
+
+def _unpack(data, offset):
+    tag = data[offset]
+    offset += 1
+    if tag == _NONE:
+        return None, offset
+    if tag == _TRUE:
+        return True, offset
+    if tag == _FALSE:
+        return False, offset
+    if tag == _INT:
+        return _i64.unpack_from(data, offset)[0], offset + 8
+    if tag == _FLOAT:
+        return _f64.unpack_from(data, offset)[0], offset + 8
+    if tag == _STR:
+        return _unpack_str(data, offset)
+    if tag == _BIGINT:
+        value, offset = _unpack_str(data, offset)
+        return int(value), offset
+    if tag == _STRINGS:
+        (size,) = _u32.unpack_from(data, offset + 4)
+        offset += 8
+        block = str(data[offset : offset + size], "utf-8")
+        return block.split("\0"), offset + size
+    if tag == _LIST:
+        (count,) = _u32.unpack_from(data, offset)
+        offset += 4
+        items = []
+        for _ in range(count):
+            item, offset = _unpack(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == _DICT:
+        (count,) = _u32.unpack_from(data, offset)
+        offset += 4
+        items = {}
+        for _ in range(count):
+            k, offset = _unpack_str(data, offset)
+            items[k], offset = _unpack(data, offset)
+        return items, offset
+    raise ValueError(f"Unknown tag {tag}.")
+
+
+def packb(value) -> bytes:
+    out = bytearray(MAGIC)
+    _pack(value, out)
+    return bytes(out)
+
+
+def unpackb(data: bytes):
+    data = memoryview(data)
+    if bytes(data[: len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a packed metadata document.")
+    value, _ = _unpack(data, len(MAGIC))
+    return value
@@ -0,0 +1,117 @@
+import logging
+
+from sys import intern
+from threading import Event, Thread
+
+
+def _intern(value):
+    if isinstance(value, str):
+        return intern(value)
+    if isinstance(value, list):
+        return [_intern(v) for v in value]
+    if isinstance(value, dict):
+        return {intern(k): _intern(v) for k, v in value.items()}
+    return value
+
+
+class Replica:
+    """
+    In-memory copy of every node metadata document of a tree.
+
+    Documents are kept in one map from relative node path to metadata with
+    interned strings, and paged children are inlined, so lookups never touch
+    the filesystem. With a change feed, `refresh()` reloads only the nodes
+    named in new change records and their ancestors. With a generation
+    marker it reloads the whole tree when the marker has changed, and
+    otherwise on every call. A background thread refreshes every `interval`
+    seconds.
+    """
+
+    def __init__(self, tree, interval: float = 30.0):
+        self._tree = tree
+        self._nodes = {}
+        self._seq = None
+        self._generation = None
+        self._stopped = Event()
+        self.load()
+        self._thread = None
+        if interval:
+            self._thread = Thread(target=self._run, args=(interval,), daemon=True)
+            self._thread.start()
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def get(self, path):
+        return self._nodes.get(path, {})
+
+    def _document(self, location, metadata):
+        tree = self._tree
+        if "children_pages" in metadata:
+            children = list(tree._iter_children(location, metadata))
+            metadata = {k: v for k, v in metadata.items() if not k == "children_pages"}
+            metadata["children"] = children
+        return _intern(metadata)
+
+    def load(self):
+        tree = self._tree._node({})
+        change_log = tree._change_log
+        # Changes made while the tree is walked are replayed by the next refresh.
+        self._seq = change_log.head() if change_log is not None else None
+        self._generation = self._read_generation()
+        root_location = tree._location_of({})
+        self._nodes = {
+            intern(path): self._document(
+                f"{root_location}/{path}".rstrip("/"), metadata
+            )
+            for path, metadata in tree._walk()
+        }
+
+    def refresh(self):
+        change_log = self._tree._change_log
+        if change_log is None:
+            if self._generation is not None:
+                if self._read_generation() == self._generation:
+                    return
+            return self.load()
+        if self._seq + 1 < change_log.floor():
+            return self.load()
+        paths, deleted = set(), set()
+        while True:
+            change = change_log.read(self._seq + 1)
+            if change is None:
+                break
+            self._seq += 1
+            if change.get("op") == "skip":
+                continue
+            parts = change.get("path", "").split("/")
+            if change.get("op") == "delete":
+                deleted.add(change.get("path"))
+                parts = parts[:-1]
+            paths.update("/".join(parts[:i]) for i in range(len(parts) + 1))
+        for path in list(self._nodes) if deleted else []:
+            if any(path == d or path.startswith(f"{d}/") for d in deleted):
+                del self._nodes[path]
+        root_location = self._tree._location_of({})
+        for path in sorted(paths - deleted):
+            location = f"{root_location}/{path}".rstrip("/")
+            metadata = self._tree._io_handler.to_dict(location, fs=self._tree._fs)
+            self._nodes[intern(path)] = self._document(location, metadata)
+
+    def _read_generation(self):
+        tree = self._tree
+        if not tree._generation_marker:
+            return None
+        return tree._io_handler.to_dict(
+            tree.root, filepath=f"{tree.root}/.generation", fs=tree._fs
+        ).get("generation", "")
+
+    def _run(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.warning(f"Replica refresh failed: {e}")
+
+    def stop(self):
+        self._stopped.set()
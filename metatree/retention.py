@@ -0,0 +1,84 @@
+"""
+Retention policies for `Metatree.gc`.
+
+A policy looks at the children of one parent node and returns the names it
+keeps. A child is deleted only when no policy keeps it, so
+`KeepLast(3), MaxAge(30 * 86400)` keeps the three newest versions plus
+anything younger than 30 days.
+"""
+
+from time import time
+
+
+def created(metadata):
+    """Creation time of a node; nodes written before it was recorded sort first."""
+    return metadata.get("_created") or 0
+
+
+class Policy:
+    def keep(self, parent: dict, children: dict) -> set:
+        """`children` maps child names to their metadata."""
+        raise NotImplementedError
+
+
+class KeepLast(Policy):
+    def __init__(self, n: int):
+        self.n = n
+
+    def keep(self, parent, children):
+        newest = sorted(children, key=lambda name: (created(children[name]), name))
+        return set(newest[-self.n :]) if self.n > 0 else set()
+
+
+class KeepReferenced(Policy):
+    """Keeps children named by a `<key>` pointer of the parent, e.g. `active`."""
+
+    def __init__(self, *keys):
+        self.keys = keys
+
+    def keep(self, parent, children):
+        values = (
+            parent.values() if not self.keys else [parent.get(key) for key in self.keys]
+        )
+        return {value for value in values if isinstance(value, str)} & set(children)
+
+
+class MaxAge(Policy):
+    """Keeps children created less than `seconds` ago."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def keep(self, parent, children):
+        cutoff = time() - self.seconds
+        # Nodes without a creation time are never expired by age.
+        return {
+            name
+            for name, metadata in children.items()
+            if not metadata.get("_created") or metadata.get("_created") >= cutoff
+        }
+
+
+def plan(nodes: dict, depth: int, policies) -> list:
+    """
+    Return the paths of the nodes at `depth` that no policy keeps.
+
+    `nodes` maps relative paths to metadata and must hold every node down to
+    `depth`.
+    """
+    children = {}
+    for path, metadata in nodes.items():
+        if path and path.count("/") + 1 == depth:
+            parent, _, name = path.rpartition("/")
+            children.setdefault(parent, {})[name] = metadata
+    deleted = []
+    for parent, siblings in children.items():
+        kept = set()
+        for policy in policies:
+            kept |= policy.keep(nodes.get(parent, {}), siblings)
+        deleted.extend(
+            f"{parent}/{name}" if parent else name
+            for name in sorted(siblings)
+            if name not in kept
+        )
+    return deleted
@@ -0,0 +1,111 @@
+"""
+Single-file archive of a tree.
+
+    MTS1 | entry data ... | table of contents | footer
+
+Metadata documents are stored in the packed encoding and artifacts as raw
+bytes. The table of contents is a packed list of `[path, kind, offset,
+size]` entries, and the footer gives its offset and size, so an archive is
+written in one sequential pass and read back from a single buffer. Local
+archives are memory-mapped; entries are sliced out without copying.
+"""
+
+import mmap
+import struct
+
+import fsspec
+
+from fsspec.implementations.local import LocalFileSystem
+
+from .packed import packb, unpackb
+
+MAGIC = b"MTS1"
+
+_footer = struct.Struct("<QQ4s")
+
+
+def join(path, name):
+    return f"{path}/{name}" if path else name
+
+
+class SnapshotWriter:
+    def __init__(self, file, chunk_size=1 << 20):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._file.write(MAGIC)
+        self._offset = len(MAGIC)
+        self._toc = []
+
+    def add(self, path, kind, data: bytes):
+        self._file.write(data)
+        self._toc.append([path, kind, self._offset, len(data)])
+        self._offset += len(data)
+
+    def add_stream(self, path, kind, source):
+        size = 0
+        while True:
+            chunk = source.read(self._chunk_size)
+            if not chunk:
+                break
+            self._file.write(chunk)
+            size += len(chunk)
+        self._toc.append([path, kind, self._offset, size])
+        self._offset += size
+
+    def close(self):
+        toc = packb(self._toc)
+        self._file.write(toc)
+        self._file.write(_footer.pack(self._offset, len(toc), MAGIC))
+
+
+class Snapshot:
+    """Read-only view of an archive written by `Metatree.export_snapshot`."""
+
+    def __init__(self, path, fs: fsspec.AbstractFileSystem = None):
+        if fs is None:
+            fs, path = fsspec.core.url_to_fs(path)
+        self._file = None
+        if isinstance(fs, LocalFileSystem):
+            self._file = open(fs._strip_protocol(path), "rb")
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._buffer = fs.cat_file(path)
+        view = memoryview(self._buffer)
+        if bytes(view[: len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a metatree snapshot.")
+        offset, size, magic = _footer.unpack_from(view, len(view) - _footer.size)
+        if magic != MAGIC:
+            raise ValueError("Truncated metatree snapshot.")
+        self.toc = {
+            path: (kind, start, length)
+            for path, kind, start, length in unpackb(view[offset : offset + size])
+        }
+        self._view = view
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, path):
+        return path in self.toc
+
+    def __iter__(self):
+        return iter(self.toc)
+
+    def kind(self, path):
+        return self.toc[path][0]
+
+    def read(self, path) -> memoryview:
+        _, offset, size = self.toc[path]
+        return self._view[offset : offset + size]
+
+    def document(self, path) -> dict:
+        return unpackb(self.read(path))
+
+    def close(self):
+        self._view.release()
+        if self._file is not None:
+            self._buffer.close()
+            self._file.close()
@@ -1,21 +1,88 @@
+import hashlib
+import mmap
+import os
+
 from functools import wraps
 from os.path import expandvars
 from pathlib import Path
+from random import random
+from time import sleep
+
+from .errors import VersionConflictError
 
 
 def with_lock(func):
     @wraps(func)
-    def wrapper(self, *args, **kwargs):
-        self.lock()
+    def wrapper(self, location, *args, **kwargs):
+        lock = self.lock(location)
         try:
-            return func(self, *args, **kwargs)
+            return func(self, location, *args, **kwargs)
         finally:
-            self.unlock()
+            self.unlock(lock)
 
     return wrapper
 
 
+hidden_keys = ("_version", "_created")
+
+
+def public_metadata(metadata):
+    return {k: v for k, v in metadata.items() if k not in hidden_keys}
+
+
+def retry_on_conflict(func, retries=10, backoff=0.01, max_backoff=1.0):
+    """Call `func` until it stops raising VersionConflictError."""
+    for attempt in range(retries):
+        try:
+            return func()
+        except VersionConflictError:
+            if attempt == retries - 1:
+                raise
+            sleep(min(max_backoff, backoff * 2**attempt) * (0.5 + random()))
+
+
 def resolve_file_url(url):
     if url.startswith("file://"):
         url = url.replace("file://", "")
     return f"file://{str(Path(expandvars(url)).resolve())}"
+
+
+def file_checksum(filepath, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
+
+
+def local_size(path):
+    """Size of a local file, or of every file below a local directory."""
+    path = Path(path)
+    if not path.is_dir():
+        return path.stat().st_size
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def iter_chunks(source, chunk_size=1 << 20):
+    """Yield the bytes of `source`: bytes, a file-like object or an iterable of chunks."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield bytes(source)
+    elif hasattr(source, "read"):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        yield from source
+
+
+def map_file(filepath):
+    """Return a read-only memory map of `filepath`."""
+    with open(filepath, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
@@ -11,10 +11,11 @@ setup(
     url="https://github.com/oboki/metatreedb",
     packages=find_packages(),
     install_requires=[
-        "fsspec",
+        # pipe_file(mode="create") backs the lease lock.
+        "fsspec>=2024.12.0",
         "hdfs",
         "pyyaml",
-        "s3fs",
+        "s3fs>=2024.12.0",
     ],
     extras_require={
         "dev": [
@@ -26,5 +27,5 @@ setup(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
     ],
-    python_requires=">=3.7",
+    python_requires=">=3.9",
 )
@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+import shutil
+import uuid
+
+from pathlib import Path
+
+from metatree.aio import AsyncMetatree
+
+
+@pytest.fixture
+def async_metatree():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    yield AsyncMetatree(f"{basepath}/metatree", ("model", "version")), basepath
+    shutil.rmtree(basepath)
+
+
+def test_async_metatree(async_metatree):
+    metatree, basepath = async_metatree
+
+    async def scenario():
+        await asyncio.gather(
+            *(
+                metatree.put(f"model_a/v{i}", f"{basepath}/trained.pkl")
+                for i in range(1, 4)
+            )
+        )
+        await metatree.update("model_a", active="v2")
+        await asyncio.gather(
+            *(
+                metatree.update(f"model_a/v{i}", model_file="trained.pkl")
+                for i in range(1, 4)
+            )
+        )
+        found = await metatree.find_many(["model_a/<active>", "model_a/v3"])
+        assert [node.location.rsplit("/", 1)[-1] for node in found] == ["v2", "v3"]
+        assert await metatree.list("model_a/v1") == ["trained.pkl"]
+        children = await metatree.children("model_a")
+        assert sorted(children) == ["v1", "v2", "v3"]
+        assert children["v1"] == {"model_file": "trained.pkl"}
+        assert await metatree.get("model_a/<active>/<model_file>") == b"spam"
+        await metatree.get("model_a/v1/trained.pkl", outfile=f"{basepath}/out.pkl")
+        assert Path(f"{basepath}/out.pkl").read_bytes() == b"spam"
+        with pytest.raises(Exception, match="does not exist"):
+            await metatree.find("model_a/v9")
+
+    asyncio.run(scenario())
@@ -0,0 +1,82 @@
+import shutil
+import uuid
+
+from pathlib import Path
+
+from metatree import Metatree
+from metatree.artifacts import ArtifactCache
+from metatree.util import map_file
+
+
+def test_artifact_cache():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    cache = ArtifactCache(f"{basepath}/cache", max_size=10)
+    fetched = []
+
+    def fetch(data):
+        def write(tmpfile):
+            fetched.append(data)
+            Path(tmpfile).write_bytes(data)
+
+        return write
+
+    first = cache.fill(cache.key("a/v1", "model.pkl", "1"), fetch(b"spam"))
+    assert cache.fill(cache.key("a/v1", "model.pkl", "1"), fetch(b"eggs")) == first
+    assert Path(first).read_bytes() == b"spam"
+    assert fetched == [b"spam"]
+    second = cache.fill(cache.key("a/v1", "model.pkl", "2"), fetch(b"ham"))
+    cache.fill(cache.key("a/v2", "model.pkl", "1"), fetch(b"bacon"))
+    assert len(cache) == 2
+    assert not Path(first).exists() and Path(second).exists()
+    assert bytes(map_file(second)) == b"ham"
+    cache.clear()
+    assert len(cache) == 0
+    shutil.rmtree(basepath)
+
+
+def test_get_from_artifact_cache(monkeypatch):
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(
+        f"{basepath}/metatree",
+        ("model", "version"),
+        manifest_enabled=True,
+        artifact_cache=f"{basepath}/cache",
+    )
+    metatree.put("model_a/v1", f"{basepath}/trained.pkl")
+    metatree.find("model_a").update(active="v1")
+    downloads = []
+    download = metatree._io_handler.download
+    monkeypatch.setattr(
+        metatree._io_handler,
+        "download",
+        lambda *args, **kwargs: downloads.append(args) or download(*args, **kwargs),
+    )
+    path = metatree.get("model_a/<active>/trained.pkl", mode="path")
+    assert Path(path).read_bytes() == b"spam"
+    assert bytes(metatree.get("model_a/v1/trained.pkl", mode="mmap")) == b"spam"
+    assert b"".join(metatree.get("model_a/v1/trained.pkl")) == b"spam"
+    metatree.get("model_a/v1/trained.pkl", outfile=f"{basepath}/out.pkl")
+    assert Path(f"{basepath}/out.pkl").read_bytes() == b"spam"
+    assert len(downloads) == 1
+    shutil.rmtree(basepath)
+
+
+def test_get_mmap_local():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(f"{basepath}/metatree", ("model", "version"))
+    metatree.put("model_a/v1", f"{basepath}/trained.pkl")
+    path = metatree.get("model_a/v1/trained.pkl", mode="path")
+    assert path == f"{basepath}/metatree/model_a/v1/trained.pkl"
+    buffer = metatree.get("model_a/v1/trained.pkl", mode="mmap")
+    assert memoryview(buffer).readonly and buffer[:] == b"spam"
+    memory = Metatree("memory://metatree", ("model", "version"))
+    try:
+        memory.get("model_a/v1/trained.pkl", mode="mmap")
+        assert False
+    except Exception as e:
+        assert "artifact cache" in str(e)
+    shutil.rmtree(basepath)
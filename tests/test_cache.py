@@ -0,0 +1,42 @@
+from metatree.cache import MetadataCache
+
+
+def test_cache_hit_and_lru_bound():
+    cache = MetadataCache(maxsize=2)
+    loads = []
+
+    def loader(key):
+        return lambda: loads.append(key) or {"key": key}
+
+    for key in ("a", "b", "a", "c"):
+        cache.get(key, loader(key), lambda: None)
+    assert loads == ["a", "b", "c"]
+    assert "b" not in cache
+    assert len(cache) == 2
+
+
+def test_cache_revalidates_by_token():
+    cache = MetadataCache()
+    token = {"value": 1}
+    loads = []
+
+    def load():
+        loads.append(token["value"])
+        return dict(token)
+
+    cache.get("a", load, lambda: token["value"])
+    cache.refresh()
+    cache.get("a", load, lambda: token["value"])
+    cache.refresh()
+    assert cache.get("a", load, lambda: token["value"]) == {"value": 1}
+    token["value"] = 2
+    cache.refresh()
+    assert cache.get("a", load, lambda: token["value"]) == {"value": 2}
+    assert loads == [1, 1, 2]
+
+
+def test_cache_disabled():
+    cache = MetadataCache(maxsize=0)
+    cache.put("a", {})
+    assert cache.get("a", lambda: {"spam": "eggs"}, lambda: None) == {"spam": "eggs"}
+    assert len(cache) == 0
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import pytest
+import shutil
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import time
+
+from metatree import AsyncMetatree, Metatree
+from metatree.instrument import Recorder, instrumentation
+
+
+def test_change_feed():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(f"{basepath}/metatree", ("model", "version"), change_feed=True)
+    metatree.put("model_a/v1", f"{basepath}/trained.pkl")
+    metatree.put("model_b/v1", f"{basepath}/trained.pkl")
+    metatree.find("model_a").update(active="v1")
+    with metatree.transaction():
+        metatree.find("model_b").update(active="v1")
+    changes = list(Metatree(f"{basepath}/metatree").watch(since=0, timeout=0))
+    assert [change["seq"] for change in changes] == [1, 2, 3, 4]
+    assert [(change["op"], change["path"]) for change in changes] == [
+        ("put", "model_a/v1"),
+        ("put", "model_b/v1"),
+        ("update", "model_a"),
+        ("update", "model_b"),
+    ]
+    assert changes[2]["metadata"] == {"active": "v1"}
+    assert [c["seq"] for c in metatree.watch("model_a", since=0, timeout=0)] == [1, 3]
+    assert list(metatree.watch(timeout=0)) == []
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        watcher = executor.submit(
+            lambda: next(
+                metatree.watch("model_a", since=4, poll_interval=0.01, timeout=5)
+            )
+        )
+        writer = Metatree(f"{basepath}/metatree")
+        writer.find("model_b").update(active="v2")
+        writer.find("model_a").update(active="v2")
+        assert watcher.result()["metadata"] == {"active": "v2"}
+
+    async def watch():
+        tree = AsyncMetatree(f"{basepath}/metatree")
+        return [c["seq"] async for c in tree.watch("model_b", since=0, timeout=0)]
+
+    assert asyncio.run(watch()) == [2, 4, 5]
+    shutil.rmtree(basepath)
+
+
+def test_change_log_gaps():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(f"{basepath}/metatree", ("model", "version"), change_feed=True)
+    for model in ("model_a", "model_b", "model_c"):
+        metatree.put(f"{model}/v1", f"{basepath}/trained.pkl")
+    # A writer that crashed between claiming a record and writing it.
+    hole = Path(f"{basepath}/metatree/.changes/000000000004")
+    hole.touch()
+    assert list(metatree.watch(since=0, timeout=0))[-1]["seq"] == 3
+    os.utime(hole, (time() - 3600, time() - 3600))
+    Metatree(f"{basepath}/metatree").find("model_a").update(active="v1")
+    changes = list(metatree.watch(since=0, timeout=0))
+    assert [change["seq"] for change in changes] == [1, 2, 3, 5]
+
+    assert metatree.compact_changes(keep=2) == 3
+    assert sorted(p.name for p in hole.parent.iterdir() if p.name.isdigit()) == [
+        "000000000004",
+        "000000000005",
+    ]
+    with pytest.raises(Exception, match="compacted"):
+        list(metatree.watch(since=0, timeout=0))
+    writer = Metatree(f"{basepath}/metatree")
+    assert writer._change_log.head() == 5
+    writer.find("model_b").update(active="v1")
+    assert [c["seq"] for c in metatree.watch(since=3, timeout=0)] == [5, 6]
+    shutil.rmtree(basepath)
+
+
+def test_append_after_falling_behind():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    behind = Metatree(f"{basepath}/metatree", ("model", "version"), change_feed=True)
+    behind._change_log.append(dict(op="update", path=""))
+    writer = Metatree(f"{basepath}/metatree")
+    for _ in range(200):
+        writer._change_log.append(dict(op="update", path=""))
+    recorder = Recorder()
+    with instrumentation(recorder):
+        assert behind._change_log.append(dict(op="update", path="")) == 202
+    assert recorder.stats["io.create"]["calls"] == 2
+    assert recorder.stats["io.exists"]["calls"] < 20
+    shutil.rmtree(basepath)
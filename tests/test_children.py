@@ -0,0 +1,77 @@
+import json
+import random
+import shutil
+import uuid
+
+from pathlib import Path
+
+from metatree import Metatree
+from metatree.children import contains, merge, normalize, page_index, split
+
+
+def test_sorted_children():
+    assert merge(["b", "d"], ["c", "a", "d"]) == ["a", "b", "c", "d"]
+    assert contains(["a", "b", "c"], "b")
+    assert normalize({"children": ["c", "a", "b"]}) == {"children": ["a", "b", "c"]}
+    assert not contains(["a", "b", "c"], "z")
+    assert split(["a", "b", "c", "d", "e"], 4) == [["a", "b"], ["c", "d"], ["e"]]
+    pages = [dict(first="a"), dict(first="m")]
+    assert page_index(pages, "0") == 0
+    assert page_index(pages, "k") == 0
+    assert page_index(pages, "x") == 1
+
+
+def test_paged_children():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(
+        f"{basepath}/metatree", ("model", "version"), children_page_size=4
+    )
+    models = [f"model_{i:02d}" for i in range(20)]
+    random.Random(0).shuffle(models)
+    for model in models:
+        metatree.put(f"{model}/v1", f"{basepath}/trained.pkl")
+    with metatree.transaction():
+        for model in models[:5]:
+            metatree.put(f"{model}/v2", f"{basepath}/trained.pkl")
+
+    reopened = Metatree(f"{basepath}/metatree")
+    pages = reopened.metadata["children_pages"]
+    assert "children" not in reopened.metadata
+    assert all(page["count"] <= 4 for page in pages)
+    assert reopened.list_children() == sorted(models)
+    assert reopened.list_children(start_after="model_09", limit=3) == [
+        "model_10",
+        "model_11",
+        "model_12",
+    ]
+    assert sorted(reopened.list()) == sorted(models)
+    assert reopened.find("model_13/v1").location.endswith("model_13/v1")
+    assert reopened.find(models[0]).list_children() == ["v1", "v2"]
+    paths = [path for path, _ in Metatree(f"{basepath}/metatree").walk(depth=1)]
+    assert paths[1:] == sorted(models)
+    try:
+        reopened.find("model_99")
+        assert False
+    except Exception as e:
+        assert "does not exist" in str(e)
+    shutil.rmtree(basepath)
+
+
+def test_legacy_unsorted_children():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(f"{basepath}/metatree", ("model", "version"))
+    for version in ("v3", "v1", "v2"):
+        metatree.put(f"model_a/{version}", f"{basepath}/trained.pkl")
+    Path(f"{basepath}/metatree/model_a/metadata.json").write_text(
+        json.dumps({"children": ["v3", "v1", "v2"]})
+    )
+    reopened = Metatree(f"{basepath}/metatree")
+    assert reopened.find("model_a/v1").location.endswith("model_a/v1")
+    reopened.put("model_a/v0", f"{basepath}/trained.pkl")
+    stored = json.loads(Path(f"{basepath}/metatree/model_a/metadata.json").read_text())
+    assert stored["children"] == ["v0", "v1", "v2", "v3"]
+    shutil.rmtree(basepath)
@@ -0,0 +1,27 @@
+import shutil
+import uuid
+
+from metatree import Metatree
+from metatree.filesystems import FileSystemRegistry, registry
+
+
+def test_registry():
+    with FileSystemRegistry(pool_size=4) as filesystems:
+        fs = filesystems.get("memory", skip_init=True, io_handler=object)
+        assert filesystems.get("memory") is fs
+        assert filesystems.get("memory", pool_size=8) is not fs
+        assert len(filesystems) == 2
+    assert len(filesystems) == 0
+    assert filesystems.get("memory") is not fs
+
+
+def test_shared_filesystem():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    root = f"{basepath}/metatree"
+    first = Metatree(root, ("model", "version"))
+    second = Metatree(root)
+    assert first._fs is second._fs
+    assert first._fs is registry.get("")
+    filesystems = FileSystemRegistry()
+    assert Metatree(root, registry=filesystems)._fs is filesystems.get("")
+    shutil.rmtree(basepath)
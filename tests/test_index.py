@@ -0,0 +1,53 @@
+import shutil
+import uuid
+
+from pathlib import Path
+
+from metatree import Metatree
+from metatree.index import dump_index, index_node, is_indexed, load_index, query_index
+
+
+def test_index_node():
+    postings, attributes = {}, {}
+    index_node(postings, attributes, "a/v1", {"stage": "prod", "children": ["x"]})
+    index_node(postings, attributes, "a/v2", {"stage": "prod", "framework": "torch"})
+    index_node(postings, attributes, "a/v1", {"stage": "dev"})
+    assert postings == {
+        "stage": {"prod": ["a/v2"], "dev": ["a/v1"]},
+        "framework": {"torch": ["a/v2"]},
+    }
+    assert attributes == {
+        "a/v1": {"stage": "dev"},
+        "a/v2": {"stage": "prod", "framework": "torch"},
+    }
+    assert is_indexed(attributes, "a/v1", {"stage": "dev", "children": ["y"]})
+    assert query_index(postings, dict(stage="prod", framework="torch")) == ["a/v2"]
+    assert query_index(postings, dict(stage="staging")) == []
+    index_node(postings, attributes, "a/v2", {})
+    assert postings == {"stage": {"dev": ["a/v1"]}}
+    assert load_index(dict(postings)) == (postings, {"a/v1": {"stage": "dev"}})
+    assert load_index(dump_index(postings, attributes)) == (postings, attributes)
+
+
+def test_query():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(f"{basepath}/metatree", ("model", "version"))
+    for model in ("model_a", "model_b"):
+        for version in ("v1", "v2"):
+            metatree.put(f"{model}/{version}", f"{basepath}/trained.pkl")
+    metatree.find("model_a/v1").update(stage="prod", framework="torch")
+    metatree.find("model_b/v2").update(stage="prod", framework="jax")
+    metatree.reindex()
+    assert metatree.query(stage="prod") == ["model_a/v1", "model_b/v2"]
+    metatree.find("model_a/v2").update(stage="prod", framework="torch")
+    metatree.find("model_a/v1").update(stage="archived")
+    assert metatree.query(stage="prod", framework="torch") == ["model_a/v2"]
+    written = Path(f"{basepath}/metatree/.index").stat().st_mtime_ns
+    metatree.put("model_a/v3", f"{basepath}/trained.pkl")
+    assert Path(f"{basepath}/metatree/.index").stat().st_mtime_ns == written
+    reopened = Metatree(f"{basepath}/metatree")
+    assert reopened.query(stage="archived") == ["model_a/v1"]
+    assert sorted(reopened.list()) == ["model_a", "model_b"]
+    shutil.rmtree(basepath)
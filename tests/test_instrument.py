@@ -0,0 +1,68 @@
+import pytest
+import shutil
+import uuid
+
+from pathlib import Path
+
+from metatree import Metatree
+from metatree.instrument import (
+    PrometheusInstrument,
+    Recorder,
+    instrumentation,
+)
+
+
+def test_recorder():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(
+        f"{basepath}/metatree", ("model", "version"), manifest_enabled=True
+    )
+    recorder = Recorder()
+    with instrumentation(recorder):
+        metatree.put("model_a/v1", f"{basepath}/trained.pkl")
+        node = metatree.find("model_a/v1")
+        node.update(stage="prod")
+        with pytest.raises(Exception):
+            metatree.find("model_b")
+    assert recorder.stats["find"]["calls"] == 2
+    assert recorder.stats["find"]["errors"] == 1
+    assert recorder.stats["lock.wait"]["calls"] >= 1
+    assert recorder.stats["io.upload"]["bytes"] == 4
+    assert recorder.calls_by_parent[("update", "lock.wait")] == 1
+    assert all(parent is not None for parent, _ in recorder.calls_by_parent)
+    calls = recorder.stats["find"]["calls"]
+    metatree.find("model_a/v1")
+    assert recorder.stats["find"]["calls"] == calls
+    shutil.rmtree(basepath)
+
+
+def test_recorder_counts_transferred_bytes():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(f"{basepath}/metatree", ("model", "version"))
+    recorder = Recorder()
+    with instrumentation(recorder):
+        metatree.put("model_a/v1", f"{basepath}/trained.pkl")
+        metatree.get("model_a/v1/trained.pkl", outfile=f"{basepath}/downloaded.pkl")
+        chunks = metatree.get("model_a/v1/trained.pkl")
+        assert "io.read" not in recorder.stats
+        assert b"".join(chunks) == b"spam"
+    assert recorder.stats["io.copy"]["bytes"] == 4
+    assert recorder.stats["io.download"]["bytes"] == 4
+    assert recorder.stats["io.read"]["bytes"] == 4
+    assert recorder.stats["io.from_dict"]["bytes"] > 0
+    assert recorder.calls_by_parent[("get", "io.read")] == 1
+    shutil.rmtree(basepath)
+
+
+def test_prometheus():
+    prometheus_client = pytest.importorskip("prometheus_client")
+    registry = prometheus_client.CollectorRegistry()
+    with instrumentation(PrometheusInstrument(registry=registry)):
+        Metatree("memory://instrumented", ("model",))
+    assert registry.get_sample_value(
+        "metatree_calls_total", dict(operation="io.exists", status="ok")
+    )
@@ -0,0 +1,87 @@
+import json
+import pytest
+import shutil
+import uuid
+
+from pathlib import Path
+
+from metatree import Metatree, VersionConflictError
+from metatree.io_handler import LocalJsonHandler
+from metatree.journal import Transaction
+from metatree.lock import NodeLock
+from metatree.util import public_metadata
+
+
+@pytest.fixture
+def metatree():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(f"{basepath}/metatree", ("model", "version"))
+    metatree.put("model_a/v1", f"{basepath}/trained.pkl")
+    yield metatree, f"{basepath}/metatree"
+    shutil.rmtree(basepath)
+
+
+def read(path):
+    return public_metadata(json.loads(Path(path).read_text()))
+
+
+def test_transaction(metatree):
+    metatree, root = metatree
+    with metatree.transaction():
+        metatree.find("model_a").update(active="v2")
+        metatree._find("model_a/v2", create_location_if_not_exists=True)
+        metatree.find("model_a/v2").update(stage="prod")
+        assert read(f"{root}/model_a/metadata.json") == {"children": ["v1"]}
+        assert metatree.find("model_a").metadata["active"] == "v2"
+    assert sorted(read(f"{root}/model_a/metadata.json")["children"]) == ["v1", "v2"]
+    assert read(f"{root}/model_a/v2/metadata.json") == {"stage": "prod"}
+    assert not list(Path(root).glob(".journal/*"))
+
+
+def test_transaction_rollback(metatree):
+    metatree, root = metatree
+    with pytest.raises(ValueError):
+        with metatree.transaction():
+            metatree.find("model_a/v1").update(stage="prod")
+            raise ValueError()
+    assert read(f"{root}/model_a/v1/metadata.json") == {}
+    assert metatree.find("model_a/v1").metadata == {}
+
+
+def test_transaction_conflict(metatree):
+    metatree, root = metatree
+    other = Metatree(root)
+    with pytest.raises(VersionConflictError):
+        with metatree.transaction():
+            metatree.find("model_a").update(active="v1")
+            other.put("model_a/v2", f"{Path(root).parent}/trained.pkl")
+    assert sorted(read(f"{root}/model_a/metadata.json")["children"]) == ["v1", "v2"]
+    assert "active" not in read(f"{root}/model_a/metadata.json")
+    assert not list(Path(root).glob(".journal/*"))
+    with metatree.transaction():
+        metatree.find("model_a").update(active="v1")
+    assert read(f"{root}/model_a/metadata.json")["active"] == "v1"
+    assert other.find("model_a/v2").list() == ["trained.pkl"]
+
+
+def test_recovery(metatree):
+    metatree, root = metatree
+    transaction = Transaction()
+    transaction.record(
+        f"file://{root}/model_a/v1",
+        f"file://{root}/model_a/v1/metadata.json",
+        {"stage": "prod"},
+    )
+    Path(f"{root}/.journal").mkdir()
+    Path(transaction.journal(root)).write_bytes(transaction.dumps(f"file://{root}"))
+    Path(f"{root}/.journal/torn").write_text('{"id": ')
+    Metatree(root, mode="readonly-replica").close()
+    assert read(f"{root}/model_a/v1/metadata.json") == {}
+    with NodeLock(f"file://{root}", [], LocalJsonHandler, metatree._fs):
+        Metatree(root)
+    assert read(f"{root}/model_a/v1/metadata.json") == {}
+    Metatree(root)
+    assert read(f"{root}/model_a/v1/metadata.json") == {"stage": "prod"}
+    assert [p.name for p in Path(root).glob(".journal/*")] == ["torn"]
@@ -0,0 +1,146 @@
+import json
+import os
+import pytest
+import shutil
+import uuid
+
+from pathlib import Path
+from time import time
+
+import fsspec
+
+from metatree.io_handler import LocalJsonHandler
+from metatree.lock import LeaseLock, NodeLock
+
+
+@pytest.fixture
+def lockfile():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    yield f"{basepath}/.lock"
+    shutil.rmtree(basepath)
+
+
+def new_lock(location, **kwargs):
+    return LeaseLock(location, LocalJsonHandler, fsspec.filesystem("file"), **kwargs)
+
+
+def test_lock_is_exclusive(lockfile):
+    with new_lock(lockfile) as held:
+        holder = json.loads(Path(lockfile).read_text())
+        assert holder["owner"] == held.owner
+        assert holder["expires"] > time()
+        contender = new_lock(lockfile, timeout=0.05)
+        assert contender.try_acquire() is False
+        with pytest.raises(Exception, match="lock failed"):
+            contender.acquire()
+    assert not Path(lockfile).exists()
+
+
+def test_stale_lock_is_broken(lockfile):
+    Path(lockfile).write_text(json.dumps(dict(owner="crashed", expires=time() - 1)))
+    with new_lock(lockfile, timeout=0.05) as held:
+        assert json.loads(Path(lockfile).read_text())["owner"] == held.owner
+
+
+def test_legacy_empty_lock_expires_by_mtime(lockfile):
+    Path(lockfile).touch()
+    os.utime(lockfile, (time() - 120, time() - 120))
+    assert new_lock(lockfile, lease=60, timeout=0.05).acquire()
+    Path(lockfile).unlink()
+    Path(lockfile).touch()
+    with pytest.raises(Exception, match="lock failed"):
+        new_lock(lockfile, lease=60, timeout=0.05).acquire()
+
+
+class RacingLock(LeaseLock):
+    """Lets `race` run right after the expiry check of `break_if_stale`."""
+
+    race = None
+
+    def holder(self, location=None):
+        holder = super().holder(location)
+        race, self.race = self.race, None
+        if race is not None:
+            race()
+        return holder
+
+
+def test_only_one_breaker_wins(lockfile):
+    Path(lockfile).write_text(json.dumps(dict(owner="crashed", expires=time() - 1)))
+    winner = new_lock(lockfile, timeout=0.05)
+    loser = RacingLock(lockfile, LocalJsonHandler, fsspec.filesystem("file"))
+    loser.race = winner.acquire
+    assert loser.break_if_stale() is False
+    assert json.loads(Path(lockfile).read_text())["owner"] == winner.owner
+    assert [p.name for p in Path(lockfile).parent.iterdir()] == [".lock"]
+    winner.release()
+    Path(lockfile).write_text(json.dumps(dict(owner="crashed", expires=time() - 1)))
+    loser.race = lambda: new_lock(lockfile).break_if_stale()
+    assert loser.break_if_stale() is True
+    assert not Path(lockfile).exists()
+
+
+def test_release_keeps_foreign_lock(lockfile):
+    held = new_lock(lockfile)
+    held.acquire()
+    Path(lockfile).write_text(json.dumps(dict(owner="other", expires=time() + 60)))
+    held.release()
+    assert Path(lockfile).exists()
+
+
+def new_node_lock(basepath, path, **kwargs):
+    parts = path.split("/")
+    return NodeLock(
+        "/".join([basepath, *parts]),
+        ["/".join([basepath, *parts[:i]]) for i in range(len(parts))],
+        LocalJsonHandler,
+        fsspec.filesystem("file"),
+        **dict(dict(timeout=0.05), **kwargs),
+    )
+
+
+def test_node_locks_on_disjoint_subtrees(lockfile):
+    basepath = str(Path(lockfile).parent)
+    for path in ("model_a/v1", "model_b/v1"):
+        Path(f"{basepath}/{path}").mkdir(parents=True)
+    with new_node_lock(basepath, "model_a/v1"):
+        with new_node_lock(basepath, "model_b/v1"):
+            assert Path(f"{basepath}/model_b/v1/.lock").exists()
+        with pytest.raises(Exception, match="lock failed"):
+            new_node_lock(basepath, "model_a/v1").acquire()
+        with pytest.raises(Exception, match="lock failed"):
+            new_node_lock(basepath, "model_a").acquire()
+    with new_node_lock(basepath, "model_a"):
+        with pytest.raises(Exception, match="lock failed"):
+            new_node_lock(basepath, "model_a/v1").acquire()
+    assert sorted(p.name for p in Path(basepath).glob("**/.lock*")) == []
+    assert sorted(p.name for p in Path(basepath).glob("**/.intents/*")) == []
+
+
+class ListingHandler(LocalJsonHandler):
+    listed = []
+
+    @classmethod
+    def iterdir(cls, location, fs):
+        cls.listed.append(location)
+        return super().iterdir(location, fs=fs)
+
+
+def test_intent_check_skips_children(lockfile):
+    basepath = str(Path(lockfile).parent)
+    for i in range(100):
+        Path(f"{basepath}/model_a/v{i}").mkdir(parents=True)
+    with new_node_lock(basepath, "model_a/v1"):
+        lock = NodeLock(
+            f"{basepath}/model_a",
+            [basepath],
+            ListingHandler,
+            fsspec.filesystem("file"),
+            timeout=0.05,
+        )
+        with pytest.raises(Exception, match="lock failed"):
+            lock.acquire()
+    assert lock.try_acquire()
+    lock.release()
+    assert set(ListingHandler.listed) == {f"{basepath}/model_a/.intents"}
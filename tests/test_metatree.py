@@ -1,14 +1,21 @@
 import asyncio
+import hashlib
+import json
 import pickle
 import pytest
 import shutil
+import time
 import uuid
 
+from concurrent.futures import ThreadPoolExecutor
+from fsspec.implementations.local import LocalFileSystem
 from functools import partial
 from pathlib import Path
+from threading import Event, Lock
 
-from metatree import Metatree
-from metatree.io_handler import LocalYamlHandler
+from metatree import Metatree, VersionConflictError
+from metatree.io_handler import LocalJsonHandler, LocalYamlHandler
+from metatree.util import retry_on_conflict
 
 
 @pytest.fixture(scope="session")
@@ -169,3 +176,329 @@ def test_lock(shared_fixture, caplog):
     asyncio.run(_test_lock(shared_fixture))
     metatree, _ = shared_fixture
     assert metatree.metadata.get("spam") == "eggs"
+
+
+def test_metadata_cache(shared_fixture):
+    metatree, basepath = shared_fixture
+    got = metatree.find("model_a/v1")
+    got.update(cached="yes")
+    with open(f"{basepath}/metatree/model_a/v1/metadata.json", "w") as file:
+        json.dump(dict(got.metadata, cached="external"), file)
+    assert got.metadata.get("cached") == "yes"
+    got.refresh()
+    assert got.metadata.get("cached") == "external"
+    got.invalidate()
+    assert metatree.find("model_a/v1").metadata.get("cached") == "external"
+
+
+def test_update_keeps_concurrent_writes():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    a = Metatree(f"{basepath}/metatree", ("model", "version", "stage"))
+    a.put("model_a/v1/training", f"{basepath}/trained.pkl")
+    node = a.find("model_a")
+    b = Metatree(f"{basepath}/metatree", ("model", "version", "stage"))
+    b.put("model_a/v2/serving", f"{basepath}/trained.pkl")
+    node.update(active="v1")
+    node.metadata = dict(node.metadata, stage="prod")
+    c = Metatree(f"{basepath}/metatree", ("model", "version", "stage"))
+    assert c.find("model_a").list_children() == ["v1", "v2"]
+    assert c.find("model_a").metadata["active"] == "v1"
+    assert c.find("model_a").metadata["stage"] == "prod"
+    assert c.find("model_a/v2/serving").list() == ["trained.pkl"]
+    shutil.rmtree(basepath)
+
+
+def test_find_missing_child(shared_fixture):
+    metatree, _ = shared_fixture
+    with pytest.raises(Exception, match="does not exist"):
+        metatree.find("model_a/v9")
+    got = metatree.find("model_a/<active>/training")
+    assert type(got) is type(metatree)
+    assert got.location.endswith("model_a/v1/training")
+
+
+def test_put_many(shared_fixture):
+    metatree, basepath = shared_fixture
+    shards = []
+    for i in range(4):
+        shards.append(Path(f"{basepath}/shard-{i}.bin"))
+        shards[-1].write_bytes(bytes([i]) * 16)
+    results = metatree.put_many(
+        [
+            *[("model_b/v1/training", shard) for shard in shards[:2]],
+            *[("model_b/v2/training", shard) for shard in shards[2:]],
+            ("model_b/v2/training", shards[2]),
+            ("model_b/v2/training", f"{basepath}/missing.bin"),
+            ("model_b/<active>/training", shards[0]),
+        ]
+    )
+    assert results[:4] == [True] * 4
+    assert [str(e) for e in results[4:]] == [
+        f"File ({shards[2]}) already exists.",
+        f"File ({basepath}/missing.bin) does not exist.",
+        "active not found in metadata.",
+    ]
+    assert sorted(metatree.find("model_b").metadata["children"]) == ["v1", "v2"]
+    assert sorted(metatree.find("model_b/v2/training").list()) == [
+        "shard-2.bin",
+        "shard-3.bin",
+    ]
+    results = metatree.put_many([("model_b/v1/training", shards[0])])
+    assert str(results[0]) == f"File ({shards[0]}) already exists."
+
+
+def test_ranged_download(shared_fixture):
+    metatree, basepath = shared_fixture
+    payload = bytes(range(256)) * 1000
+    Path(f"{basepath}/large.bin").write_bytes(payload)
+    metatree.put("model_a/v1/training", f"{basepath}/large.bin")
+    metatree.get(
+        "model_a/v1/training/large.bin",
+        outfile=f"{basepath}/large-downloaded.bin",
+        block_size=4096,
+        max_workers=4,
+    )
+    assert Path(f"{basepath}/large-downloaded.bin").read_bytes() == payload
+    chunks = list(metatree.get("model_a/v1/training/large.bin", chunk_size=65536))
+    assert len(chunks) == 4 and b"".join(chunks) == payload
+
+
+def test_walk(shared_fixture):
+    metatree, _ = shared_fixture
+    paths = [path for path, _ in metatree.find("model_b").walk()]
+    assert sorted(paths) == [
+        "model_b",
+        "model_b/v1",
+        "model_b/v1/training",
+        "model_b/v2",
+        "model_b/v2/training",
+    ]
+    metatree.set_location_to_root()
+    assert sorted(path for path, _ in metatree.walk(depth=1)) == [
+        "",
+        "model_a",
+        "model_b",
+    ]
+    assert [
+        path
+        for path, _ in metatree.walk(
+            filter=lambda path, metadata: metadata.get("active") == "v1",
+            batch_size=2,
+        )
+    ] == ["model_a"]
+
+
+def test_manifest():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    Path(f"{basepath}/config.json").write_bytes(b"{}")
+    metatree = Metatree(
+        f"{basepath}/metatree", ("model", "version"), manifest_enabled=True
+    )
+    assert metatree.put("model_a/v1", f"{basepath}/trained.pkl") == True
+    assert metatree.put_many([("model_a/v1", f"{basepath}/config.json")]) == [True]
+    files = metatree.find("model_a/v1").metadata["files"]
+    assert sorted(files) == ["config.json", "trained.pkl"]
+    assert files["trained.pkl"]["size"] == 4
+    assert files["trained.pkl"]["checksum"] == (
+        "sha256:4e388ab32b10dc8dbc7e28144f552830adc74787c1e2c0824032078a79f227fb"
+    )
+    Path(f"{basepath}/metatree/model_a/v1/untracked.txt").touch()
+    assert sorted(metatree.find("model_a/v1").list()) == ["config.json", "trained.pkl"]
+    assert metatree.get("model_a/v1/untracked.txt") is None
+    assert b"".join(metatree.get("model_a/v1/trained.pkl")) == b"spam"
+    with pytest.raises(Exception, match="already exists"):
+        metatree.put("model_a/v1", f"{basepath}/trained.pkl")
+    with pytest.raises(Exception, match="cannot update files"):
+        metatree.find("model_a/v1").update(files="spam")
+    shutil.rmtree(basepath)
+
+
+def test_content_addressed():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/tokenizer.json").write_bytes(b"spam")
+    metatree = Metatree(
+        f"{basepath}/metatree", ("model", "version"), content_addressed=True
+    )
+    for version in ("v1", "v2"):
+        assert metatree.put(f"model_a/{version}", f"{basepath}/tokenizer.json")
+    blobs = list(Path(f"{basepath}/metatree/.blobs").glob("*/*"))
+    assert len(blobs) == 1
+    assert not Path(f"{basepath}/metatree/model_a/v1/tokenizer.json").exists()
+    entry = metatree.find("model_a/v2").metadata["files"]["tokenizer.json"]
+    assert entry["blob"] == f".blobs/{blobs[0].parent.name}/{blobs[0].name}"
+    assert metatree.find("model_a/v2").list() == ["tokenizer.json"]
+    assert b"".join(metatree.get("model_a/v2/tokenizer.json")) == b"spam"
+    metatree.get("model_a/v1/tokenizer.json", outfile=f"{basepath}/out.json")
+    assert Path(f"{basepath}/out.json").read_bytes() == b"spam"
+    blobs[0].write_bytes(b"eggs")
+    with pytest.raises(Exception, match="Checksum mismatch"):
+        metatree.get("model_a/v1/tokenizer.json", outfile=f"{basepath}/bad.json")
+    shutil.rmtree(basepath)
+
+
+@pytest.mark.parametrize(
+    "options", [{}, {"manifest_enabled": True}, {"content_addressed": True}]
+)
+def test_put_stream(options):
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam" * 1000)
+    metatree = Metatree(f"{basepath}/metatree", ("model", "version"), **options)
+    memory = Metatree(
+        f"memory://{uuid.uuid4().hex[:8]}", ("model", "version"), **options
+    )
+    assert metatree.put_stream("model_a/v1", "a.bin", b"spam")
+    with open(f"{basepath}/trained.pkl", "rb") as file:
+        assert metatree.put_stream("model_a/v1", "b.bin", file, block_size=5 << 20)
+    assert metatree.put_stream("model_a/v2", "c.bin", iter([b"sp", b"am"]))
+    assert b"".join(metatree.get("model_a/v1/a.bin")) == b"spam"
+    assert b"".join(metatree.get("model_a/v1/b.bin")) == b"spam" * 1000
+    assert b"".join(metatree.get("model_a/v2/c.bin")) == b"spam"
+    assert sorted(metatree.find("model_a/v1").list()) == ["a.bin", "b.bin"]
+    with pytest.raises(Exception, match="already exists"):
+        metatree.put_stream("model_a/v1", "a.bin", b"eggs")
+
+    def broken():
+        yield b"spam"
+        raise IOError("connection reset")
+
+    with pytest.raises(IOError):
+        metatree.put_stream("model_a/v2", "d.bin", broken())
+    assert metatree.find("model_a/v2").list() == ["c.bin"]
+    with pytest.raises(IOError):
+        memory.put_stream("model_a/v1", "d.bin", broken())
+    assert memory.put_stream("model_a/v1", "d.bin", b"spam")
+    assert b"".join(memory.get("model_a/v1/d.bin")) == b"spam"
+    assert not list(Path(f"{basepath}/metatree").rglob("*partial*"))
+    if options.get("manifest_enabled") or options.get("content_addressed"):
+        entry = metatree.find("model_a/v1").metadata["files"]["a.bin"]
+        assert entry["size"] == 4
+        assert entry["checksum"] == f"sha256:{hashlib.sha256(b'spam').hexdigest()}"
+    if options.get("content_addressed"):
+        assert len(list(Path(f"{basepath}/metatree/.blobs").glob("*/*"))) == 2
+    shutil.rmtree(basepath)
+
+
+class ConditionalJsonHandler(LocalJsonHandler):
+    _conditional_writes = True
+    _mutex = Lock()
+
+    @classmethod
+    def etag(cls, location, fs):
+        return fs.info(location).get("mtime")
+
+    @classmethod
+    def write_if_match(cls, location, data, etag, fs):
+        with cls._mutex:
+            if not cls.etag(location, fs) == etag:
+                raise VersionConflictError(location)
+            fs.pipe_file(location, data)
+
+
+class SlowReadHandler(ConditionalJsonHandler):
+    """Pauses after reading `model_a`, between a writer's read and its write."""
+
+    read = None
+
+    @classmethod
+    def to_dict(cls, location, filepath=None, fs=None):
+        metadata = super().to_dict(location, filepath=filepath, fs=fs)
+        if cls.read is not None and str(filepath).endswith("model_a/metadata.json"):
+            cls.read.set()
+            time.sleep(0.3)
+        return metadata
+
+
+def test_conditional_update_waits_for_locked_writers():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(
+        f"{basepath}/metatree", ("model", "version"), io_handler=SlowReadHandler
+    )
+    metatree.put("model_a/v1", f"{basepath}/trained.pkl")
+    node = metatree.find("model_a")
+    version = node.version
+    SlowReadHandler.read = Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        put = executor.submit(
+            metatree._node({}).put, "model_a/v2", f"{basepath}/trained.pkl"
+        )
+        assert SlowReadHandler.read.wait(timeout=5)
+        SlowReadHandler.read = None
+        try:
+            updated = node.update(if_version=version, active="v1")
+        except VersionConflictError:
+            updated = None
+        put.result()
+    stored = json.loads(Path(f"{basepath}/metatree/model_a/metadata.json").read_text())
+    assert stored["children"] == ["v1", "v2"]
+    if updated is not None:
+        assert stored["active"] == "v1"
+        assert stored["_version"] == updated
+    shutil.rmtree(basepath)
+
+
+@pytest.mark.parametrize("io_handler", [LocalJsonHandler, ConditionalJsonHandler])
+def test_conditional_update(io_handler):
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    metatree = Metatree(
+        f"{basepath}/metatree", ("model", "version"), io_handler=io_handler
+    )
+    metatree._find("model_a", create_location_if_not_exists=True)
+    node = metatree.find("model_a")
+    version = node.version
+    assert node.update(if_version=version, stage="dev") == version + 1
+    assert "_version" not in node.metadata
+    with pytest.raises(VersionConflictError):
+        node.update(if_version=version, stage="prod")
+    assert metatree.find("model_a").metadata["stage"] == "dev"
+
+    def increment():
+        node = metatree.find("model_a")
+        runs = int(node.metadata.get("runs", 0))
+        node.update(if_version=node.version, runs=runs + 1)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: retry_on_conflict(increment, retries=50), range(8)))
+    assert metatree.find("model_a").metadata["runs"] == "8"
+    shutil.rmtree(basepath)
+
+
+class ListingCacheFileSystem(LocalFileSystem):
+    """Answers `info` from a cache until it is invalidated, like s3fs."""
+
+    cachable = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.listing = {}
+
+    def info(self, path, **kwargs):
+        path = self._strip_protocol(path)
+        if path not in self.listing:
+            self.listing[path] = super().info(path, **kwargs)
+        return self.listing[path]
+
+    def invalidate_cache(self, path=None):
+        if path is None:
+            self.listing.clear()
+        else:
+            self.listing.pop(self._strip_protocol(path), None)
+
+
+def test_validators_skip_listing_cache():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/metadata.json").write_text("{}")
+    fs = ListingCacheFileSystem()
+    fs.info(f"{basepath}/metadata.json")
+    token = LocalJsonHandler.token(f"{basepath}/metadata.json", fs=fs)
+    Path(f"{basepath}/metadata.json").write_text('{"stage": "prod"}')
+    assert not LocalJsonHandler.token(f"{basepath}/metadata.json", fs=fs) == token
+    shutil.rmtree(basepath)
@@ -0,0 +1,41 @@
+import shutil
+import uuid
+
+from pathlib import Path
+
+from metatree import Metatree
+from metatree.io_handler import LocalJsonHandler, LocalPackedHandler
+from metatree.migrate import migrate
+from metatree.packed import packb, unpackb
+
+
+def test_packb_roundtrip():
+    document = {
+        "children": ["v1", "v2", ""],
+        "active": "v2",
+        "files": {"trained.pkl": {"size": 4, "mtime": 1.5, "blob": None}},
+        "flags": [True, False, 1 << 70, -3, ["nested"], []],
+    }
+    assert unpackb(packb(document)) == document
+    assert LocalPackedHandler.loads(b"") == {}
+    assert LocalPackedHandler.loads(LocalPackedHandler.dumps({"children": ["b", "a"]}))[
+        "children"
+    ] == ["a", "b"]
+
+
+def test_packed_tree_and_migration():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    root = f"{basepath}/metatree"
+    metatree = Metatree(root, ("model", "version"), io_handler=LocalJsonHandler)
+    metatree.put("model_a/v1", f"{basepath}/trained.pkl")
+    metatree.find("model_a").update(active="v1")
+    assert migrate(root, LocalJsonHandler, LocalPackedHandler, remove_source=True) == 3
+    assert not list(Path(root).glob("**/metadata.json"))
+    packed = Metatree(root, io_handler=LocalPackedHandler)
+    assert packed.find("model_a/<active>").list() == ["trained.pkl"]
+    packed.put("model_a/v2", f"{basepath}/trained.pkl")
+    assert Path(f"{root}/model_a/v2/metadata.bin").read_bytes().startswith(b"MTP1")
+    assert packed.find("model_a").metadata == {"children": ["v1", "v2"], "active": "v1"}
+    shutil.rmtree(basepath)
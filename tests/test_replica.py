@@ -0,0 +1,96 @@
+import pytest
+import shutil
+import uuid
+
+from pathlib import Path
+
+from metatree import Metatree
+from metatree.instrument import Recorder, instrumentation
+
+
+def test_replica():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    writer = Metatree(
+        f"{basepath}/metatree",
+        ("model", "version"),
+        manifest_enabled=True,
+        change_feed=True,
+        children_page_size=2,
+    )
+    for model in ("model_a", "model_b", "model_c"):
+        writer.put(f"{model}/v1", f"{basepath}/trained.pkl")
+    writer.find("model_a").update(active="v1")
+    replica = Metatree(
+        f"{basepath}/metatree", mode="readonly-replica", replica_interval=None
+    )
+    assert len(replica._replica) == 7
+    recorder = Recorder()
+    with instrumentation(recorder):
+        node = replica.find("model_a/<active>")
+        assert node.location.endswith("model_a/v1")
+        assert node.list() == ["trained.pkl"]
+        assert sorted(replica._node({}).list_children()) == [
+            "model_a",
+            "model_b",
+            "model_c",
+        ]
+    assert not any(op.startswith("io.") for op in recorder.stats)
+    assert b"".join(replica.get("model_a/<active>/trained.pkl")) == b"spam"
+
+    writer.put("model_a/v2", f"{basepath}/trained.pkl")
+    writer.find("model_a").update(active="v2")
+    assert replica.find("model_a").metadata["active"] == "v1"
+    replica._replica.refresh()
+    assert replica.find("model_a/<active>").location.endswith("model_a/v2")
+    with pytest.raises(Exception, match="read-only replica"):
+        replica.find("model_a").update(active="v1")
+    with pytest.raises(Exception, match="read-only replica"):
+        replica.put("model_d/v1", f"{basepath}/trained.pkl")
+    replica.close()
+    shutil.rmtree(basepath)
+
+
+def test_replica_without_change_feed():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    with pytest.raises(Exception, match="not a metatree"):
+        Metatree(f"{basepath}/missing", mode="readonly-replica")
+    assert not Path(f"{basepath}/missing").exists()
+
+    writer = Metatree(
+        f"{basepath}/metatree", ("model", "version"), generation_marker=True
+    )
+    writer.put("model_a/v1", f"{basepath}/trained.pkl")
+    replica = Metatree(
+        f"{basepath}/metatree", mode="readonly-replica", replica_interval=None
+    )
+    recorder = Recorder()
+    with instrumentation(recorder):
+        replica._replica.refresh()
+    assert recorder.stats["io.to_dict"]["calls"] == 1
+    assert "io.listdir" not in recorder.stats and "io.iterdir" not in recorder.stats
+    writer.find("model_a").update(active="v1")
+    replica._replica.refresh()
+    assert replica.find("model_a/<active>").location.endswith("model_a/v1")
+    replica.close()
+    shutil.rmtree(basepath)
+
+
+def test_replica_without_generation_marker():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    writer = Metatree(f"{basepath}/metatree", ("model", "version"))
+    writer.put("model_a/v1", f"{basepath}/trained.pkl")
+    assert not Path(f"{basepath}/metatree/.generation").exists()
+    replica = Metatree(
+        f"{basepath}/metatree", mode="readonly-replica", replica_interval=None
+    )
+    writer.find("model_a").update(active="v1")
+    replica._replica.refresh()
+    assert replica.find("model_a/<active>").location.endswith("model_a/v1")
+    replica.close()
+    shutil.rmtree(basepath)
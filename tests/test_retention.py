@@ -0,0 +1,74 @@
+import json
+import pytest
+import shutil
+import uuid
+
+from pathlib import Path
+
+from metatree import Metatree
+from metatree.retention import KeepLast, KeepReferenced, MaxAge
+
+
+def test_gc():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    metatree = Metatree(
+        f"{basepath}/metatree",
+        ("model", "version"),
+        content_addressed=True,
+        indexing_enabled=True,
+        change_feed=True,
+        children_page_size=2,
+    )
+    for version in ("v1", "v2", "v3", "v4", "v5"):
+        Path(f"{basepath}/{version}.pkl").write_bytes(version.encode())
+        metatree.put(f"model_a/{version}", f"{basepath}/{version}.pkl")
+    metatree.put("model_b/v1", f"{basepath}/trained.pkl")
+    metatree.find("model_a").update(active="v1")
+
+    assert metatree.gc(
+        "version", KeepLast(2), KeepReferenced("active"), dry_run=True
+    ) == [
+        "model_a/v2",
+        "model_a/v3",
+    ]
+    assert metatree.find("model_a/v2").list() == ["v2.pkl"]
+
+    deleted = metatree.gc("version", KeepLast(2), KeepReferenced("active"))
+    assert deleted == ["model_a/v2", "model_a/v3"]
+    assert list(metatree._node({}).find("model_a").list_children()) == [
+        "v1",
+        "v4",
+        "v5",
+    ]
+    with pytest.raises(Exception):
+        metatree._node({}).find("model_a/v2")
+    assert not Path(f"{basepath}/metatree/model_a/v3").exists()
+    assert b"".join(metatree.get("model_a/<active>/v1.pkl")) == b"v1"
+    blobs = [p for p in Path(f"{basepath}/metatree/.blobs").rglob("*") if p.is_file()]
+    assert len(blobs) == 4
+    assert [record["op"] for record in metatree.watch(since=0, timeout=0)][-2:] == [
+        "delete",
+        "delete",
+    ]
+
+    metatree.find("model_a/v5").update(stage="archived")
+    raw = json.loads(Path(f"{basepath}/metatree/model_a/v5/metadata.json").read_text())
+    assert raw["stage"] == "archived" and raw["_created"] > 0
+    assert metatree.gc("version", MaxAge(3600)) == []
+    assert metatree.gc("version", KeepLast(1)) == ["model_a/v1", "model_a/v4"]
+    assert list(metatree._node({}).find("model_a").list_children()) == ["v5"]
+    pages = (
+        metatree._node({})
+        .find("model_a")
+        ._to_dict(f"{basepath}/metatree/model_a")["children_pages"]
+    )
+    assert len(list(Path(f"{basepath}/metatree/model_a").glob(".children.*"))) == len(
+        pages
+    )
+
+    with pytest.raises(Exception):
+        metatree.gc("version")
+
+    shutil.rmtree(basepath)
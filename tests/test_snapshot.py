@@ -0,0 +1,50 @@
+import shutil
+import uuid
+
+from pathlib import Path
+
+from metatree import Metatree
+from metatree.snapshot import Snapshot
+
+
+def test_snapshot():
+    basepath = f"/tmp/{uuid.uuid4().hex[:8]}"
+    Path(basepath).mkdir()
+    Path(f"{basepath}/trained.pkl").write_bytes(b"spam")
+    Path(f"{basepath}/config.json").write_bytes(b"{}")
+    metatree = Metatree(
+        f"{basepath}/metatree",
+        ("model", "version"),
+        content_addressed=True,
+        children_page_size=2,
+    )
+    for model in ("model_a", "model_b", "model_c"):
+        metatree.put(f"{model}/v1", f"{basepath}/trained.pkl")
+    metatree.put("model_a/v1", f"{basepath}/config.json")
+    metatree.find("model_a").update(active="v1")
+    metatree.reindex()
+
+    metatree.export_snapshot(f"{basepath}/metadata.mts")
+    with Snapshot(f"{basepath}/metadata.mts") as snapshot:
+        assert snapshot.document("model_a")["active"] == "v1"
+        assert snapshot.kind(".metatree") == "document"
+        assert not any(snapshot.kind(path) == "file" for path in snapshot)
+
+    metatree.export_snapshot(f"{basepath}/full.mts", include_files=True)
+    for root in (f"{basepath}/loaded", f"memory://{uuid.uuid4().hex[:8]}"):
+        loaded = Metatree.load_snapshot(f"{basepath}/full.mts", root)
+        assert list(loaded.walk()) == list(Metatree(f"{basepath}/metatree").walk())
+        assert loaded.query(active="v1") == ["model_a"]
+        assert b"".join(loaded.get("model_a/<active>/trained.pkl")) == b"spam"
+        assert b"".join(loaded.get("model_c/v1/trained.pkl")) == b"spam"
+        assert b"".join(loaded.get("model_a/v1/config.json")) == b"{}"
+    archive = f"memory://{uuid.uuid4().hex[:8]}/full.mts"
+    metatree.export_snapshot(archive, include_files=True)
+    loaded = Metatree.load_snapshot(archive, f"{basepath}/from-memory")
+    assert b"".join(loaded.get("model_c/v1/trained.pkl")) == b"spam"
+    try:
+        Metatree.load_snapshot(f"{basepath}/full.mts", f"{basepath}/loaded")
+        assert False
+    except Exception as e:
+        assert "already in use" in str(e)
+    shutil.rmtree(basepath)